@@ -0,0 +1,235 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Пересборка дайджестов за прошедшие дни по сохранённым снимкам лент.
+
+    python backfill.py 2024-05-01 2024-06-30 snapshots/ --pipeline=digest --workers=4
+
+Дни диапазона обрабатываются параллельно в пуле процессов; результат каждого
+дня пишется в <output>/<pipeline>/<дата>.json (части сообщения Telegram,
+а для digest ещё и HTML страницы Telegra.ph) и никуда не отправляется.
+Готовые дни при повторном запуске пропускаются, так что прерванный backfill
+продолжается с места остановки; --force пересобирает всё, например после
+смены промпта или порога группировки.
+
+Снимки - RSS-файлы (.xml, .rss, можно .gz) в каталоге snapshots. Дата
+снимка берётся из имени файла (feed_2024-05-02.xml): для дня D читаются
+снимки за D..D+lookahead, потому что лента хранит и новости прошлых дней.
+Снимки без даты в имени читаются для каждого дня.
+
+pipeline=digest - категории и группировка, как в non-gpt.py; сюжеты прошлых
+дней (StoryIndex) не учитываются, потому что дни идут не по порядку.
+pipeline=summary - сводка LLM, как в main.py, через llm_backend.
+Переопределения конфигурации KEY=VALUE указываются после позиционных аргументов.
+"""
+import startup_profile
+
+startup_profile.install_if_requested()
+
+import argparse  # noqa: E402
+import datetime  # noqa: E402
+import gzip  # noqa: E402
+import json  # noqa: E402
+import os  # noqa: E402
+import re  # noqa: E402
+import sys  # noqa: E402
+import time  # noqa: E402
+from concurrent.futures import ProcessPoolExecutor, as_completed  # noqa: E402
+
+from config import validate_config  # noqa: E402
+from feeds import iter_feed_items  # noqa: E402
+from files import atomic_write  # noqa: E402
+from llm_usage import usage  # noqa: E402
+from metrics import RunMetrics  # noqa: E402
+
+PIPELINES = ('digest', 'summary')
+SNAPSHOT_SUFFIXES = ('.xml', '.rss', '.xml.gz', '.rss.gz')
+SNAPSHOT_DATE = re.compile(r'(\d{4}-\d{2}-\d{2})')
+# Снимок за день S содержит новости S и нескольких предыдущих дней
+SNAPSHOT_LOOKAHEAD_DAYS = 2
+# Процессов по умолчанию: каждый держит до MAX_IN_FLIGHT / workers запросов к LLM
+# и пишет в общий кэш классификации, так что больше нескольких не ускоряет
+DEFAULT_WORKERS = min(4, os.cpu_count() or 1)
+
+base_directory = os.path.dirname(os.path.abspath(__file__))
+
+
+def find_snapshots(directory: str) -> list:
+    """Пары (дата из имени или None, путь) для всех снимков в каталоге и подкаталогах."""
+    snapshots = []
+    for root, _, names in os.walk(directory):
+        for name in sorted(names):
+            if not name.lower().endswith(SNAPSHOT_SUFFIXES):
+                continue
+            match = SNAPSHOT_DATE.search(name)
+            try:
+                day = datetime.date.fromisoformat(match.group(1)) if match else None
+            except ValueError:
+                day = None
+            snapshots.append((day, os.path.join(root, name)))
+    return snapshots
+
+
+def snapshots_for_day(snapshots: list, day: datetime.date, lookahead: int = SNAPSHOT_LOOKAHEAD_DAYS) -> list:
+    last = day + datetime.timedelta(days=lookahead)
+    return [path for snapshot_day, path in snapshots if snapshot_day is None or day <= snapshot_day <= last]
+
+
+def read_snapshot_items(paths: list, day: datetime.date) -> tuple:
+    """Элементы за day из снимков без повторов ссылок и {путь: ошибка} для нечитаемых снимков."""
+    items, errors, seen_links = [], {}, set()
+    for path in paths:
+        try:
+            with (gzip.open(path, 'rb') if path.endswith('.gz') else open(path, 'rb')) as source:
+                snapshot_items = list(iter_feed_items(source, day, day))
+        except Exception as e:
+            errors[path] = repr(e)
+            continue
+        for item in snapshot_items:
+            if item['pubDate'] == day and item['link'] not in seen_links:
+                seen_links.add(item['link'])
+                items.append(item)
+    return items, errors
+
+
+def backfill_digest(items: list, day: datetime.date, workers: int = 1) -> dict:
+    import pandas as pd
+
+    from classification import MAX_IN_FLIGHT
+    from deduplication import deduplication
+    from digest import classify_headlines, items_for_day
+    from rendering import render_digest
+
+    data = items_for_day(pd.DataFrame(items, columns=['headline', 'link', 'pubDate', 'description']), day)
+    if data.empty:
+        return {'stories': 0, 'telegram': [], 'telegraph': ''}
+    # Локальный классификатор не дообучаем: его файл общий для всех процессов пула
+    data['category'] = classify_headlines(data['headline'].tolist(), base_directory,
+                                          RunMetrics('backfill', day.isoformat()),
+                                          # Общий для пула предел запросов к LLM, а не на каждый процесс
+                                          max_in_flight=max(1, MAX_IN_FLIGHT // workers))
+    result = deduplication(data)
+    rendered = render_digest(result)
+    return {'stories': len(result), 'telegram': rendered.telegram_chunks(), 'telegraph': rendered.telegraph}
+
+
+def backfill_summary(items: list, day: datetime.date) -> dict:
+    from llm_backend import get_router
+    from llm_usage import BudgetExceeded
+    from summarization import add_missing, summarize
+    from telegram_html import split_html
+
+    titles = [(item['headline'], item['link']) for item in items]
+    if not titles:
+        return {'summary': '', 'telegram': []}
+    router = get_router(('openai',))
+    try:
+        summary = summarize(titles, router.complete)
+    except BudgetExceeded:
+        # Как в main.py: список заголовков со ссылками без обращения к LLM
+        summary = add_missing("", titles)
+    return {'summary': summary, 'telegram': split_html(summary)}
+
+
+def output_path(output: str, pipeline: str, day: datetime.date) -> str:
+    return os.path.join(output, pipeline, f"{day.isoformat()}.json")
+
+
+def process_day(pipeline: str, day: datetime.date, paths: list, path: str, workers: int = 1) -> dict:
+    """Собирает дайджест одного дня в процессе пула и пишет его в path."""
+    started = time.perf_counter()
+    # Процесс пула обрабатывает несколько дней подряд: учёт и бюджет LLM - на каждый день
+    usage.reset()
+    items, errors = read_snapshot_items(paths, day)
+    result = backfill_digest(items, day, workers) if pipeline == 'digest' else backfill_summary(items, day)
+    report = {
+        'day': day.isoformat(),
+        'pipeline': pipeline,
+        'items': len(items),
+        'seconds': round(time.perf_counter() - started, 3),
+        'cost_usd': usage.summary()['cost_usd'],
+    }
+    result = dict(report, snapshots=[os.path.basename(path) for path in paths], snapshot_errors=errors, **result)
+    # Прерванный день не должен выглядеть готовым
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with atomic_write(path) as file:
+        json.dump(result, file, ensure_ascii=False, default=str)
+    return report
+
+
+def days_between(start: datetime.date, end: datetime.date) -> list:
+    return [start + datetime.timedelta(days=offset) for offset in range((end - start).days + 1)]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Пересборка дайджестов за прошедшие дни по снимкам лент")
+    parser.add_argument('start', type=datetime.date.fromisoformat, help="первый день, ГГГГ-ММ-ДД")
+    parser.add_argument('end', type=datetime.date.fromisoformat, help="последний день включительно")
+    parser.add_argument('snapshots', help="каталог с сохранёнными RSS-снимками")
+    parser.add_argument('--pipeline', choices=PIPELINES, default='digest')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS, help="число процессов")
+    parser.add_argument('--output', default=os.path.join(base_directory, "backfill"))
+    parser.add_argument('--lookahead', type=int, default=SNAPSHOT_LOOKAHEAD_DAYS,
+                        help="сколько дней после D смотреть снимки для дня D")
+    parser.add_argument('--force', action='store_true', help="пересобрать и уже готовые дни")
+    # Остальное - переопределения конфигурации KEY=VALUE, их читает config.py
+    arguments, _ = parser.parse_known_args()
+    if arguments.end < arguments.start:
+        parser.error("конец диапазона раньше начала")
+
+    if arguments.pipeline == 'digest':
+        validate_config(("openai_token",))
+    else:
+        from llm_backend import get_router
+
+        # Проверяет ключи провайдеров до запуска пула
+        get_router(('openai',))
+
+    snapshots = find_snapshots(arguments.snapshots)
+    days, skipped, empty = [], 0, []
+    for day in days_between(arguments.start, arguments.end):
+        if not arguments.force and os.path.exists(output_path(arguments.output, arguments.pipeline, day)):
+            skipped += 1
+            continue
+        paths = snapshots_for_day(snapshots, day, arguments.lookahead)
+        if paths:
+            days.append((day, paths))
+        else:
+            # День без снимков не записываем, чтобы его собрал повторный запуск после докачки
+            empty.append(day)
+    print(f"Дней: {len(days)} к обработке, {skipped} уже готовы, {len(empty)} без снимков; "
+          f"снимков найдено: {len(snapshots)}")
+
+    started = time.perf_counter()
+    done, items, cost, failed = 0, 0, 0.0, {}
+    workers = max(1, min(arguments.workers, len(days) or 1))
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(process_day, arguments.pipeline, day, paths,
+                                   output_path(arguments.output, arguments.pipeline, day), workers): day
+                   for day, paths in days}
+        for future in as_completed(futures):
+            day = futures[future]
+            done += 1
+            elapsed = time.perf_counter() - started
+            remaining = elapsed / done * (len(days) - done)
+            try:
+                report = future.result()
+            except Exception as e:
+                failed[day] = repr(e)
+                print(f"[{done}/{len(days)}] {day}: ошибка {e!r}; осталось ~{remaining:.0f} с")
+                continue
+            items += report['items']
+            cost += report['cost_usd']
+            print(f"[{done}/{len(days)}] {day}: {report['items']} новостей за {report['seconds']:.1f} с, "
+                  f"${report['cost_usd']:.4f}; осталось ~{remaining:.0f} с")
+
+    print(f"Готово за {time.perf_counter() - started:.1f} с: {done - len(failed)} дней, {items} новостей, "
+          f"LLM ${cost:.4f}")
+    if empty:
+        print("Нет снимков: " + ", ".join(day.isoformat() for day in empty))
+    if failed:
+        print("С ошибкой (будут собраны при повторном запуске): " + ", ".join(day.isoformat() for day in sorted(failed)))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
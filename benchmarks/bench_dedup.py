@@ -0,0 +1,69 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Сравнение прежней (плотной n x n) и блочной разреженной дедупликации.
+
+Запуск: python benchmarks/bench_dedup.py [размеры...]
+"""
+import os
+import sys
+import time
+import tracemalloc
+
+import pandas as pd
+from scipy.sparse import csr_matrix
+from scipy.sparse.csgraph import connected_components
+from sklearn.feature_extraction.text import TfidfVectorizer
+from sklearn.metrics.pairwise import cosine_similarity
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from deduplication import deduplication  # noqa: E402
+from synthetic_feed import synthetic_headlines  # noqa: E402
+
+DEFAULT_SIZES = [300, 1000, 3000, 10000]
+# Выше этого размера плотная матрица не помещается в разумную память
+DENSE_LIMIT = 10000
+
+
+def dense_group_ids(data):
+    # Прежняя реализация: плотная матрица сходства n x n
+    tfidf_matrix = TfidfVectorizer().fit_transform(data['headline'])
+    graph = csr_matrix(cosine_similarity(tfidf_matrix) > 0.5)
+    return connected_components(csgraph=graph, directed=False, return_labels=True)[1]
+
+
+def same_partition(left, right) -> bool:
+    # Номера групп могут отличаться, сравниваем сами разбиения
+    pairs = set(zip(left, right))
+    return len(pairs) == len(set(left)) == len(set(right))
+
+
+def measure(function, *args):
+    tracemalloc.start()
+    started = time.perf_counter()
+    result = function(*args)
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return result, elapsed, peak
+
+
+def main(sizes):
+    print(f"{'n':>7} {'dense, с':>10} {'dense, МБ':>10} {'sparse, с':>10} {'sparse, МБ':>11} {'групп':>7}")
+    for n in sizes:
+        headlines = synthetic_headlines(n)
+        data = pd.DataFrame({'headline': headlines, 'link': [f"https://example.com/{i}" for i in range(n)]})
+        sparse_data = data.copy()
+        result, sparse_time, sparse_peak = measure(deduplication, sparse_data)
+        result_labels = sparse_data['group_id'].to_numpy()
+        if n <= DENSE_LIMIT:
+            labels, dense_time, dense_peak = measure(dense_group_ids, data.copy())
+            assert same_partition(labels, result_labels), "результаты реализаций расходятся"
+            dense = f"{dense_time:>10.3f} {dense_peak / 2 ** 20:>10.1f}"
+        else:
+            dense = f"{'-':>10} {'-':>10}"
+        print(f"{n:>7} {dense} {sparse_time:>10.3f} {sparse_peak / 2 ** 20:>11.1f} {len(result):>7}")
+
+
+if __name__ == '__main__':
+    main([int(size) for size in sys.argv[1:]] or DEFAULT_SIZES)
@@ -0,0 +1,127 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Офлайн-бенчмарк конвейера дайджеста на синтетических лентах, LLM заменена заглушкой.
+
+Замеряет разбор ленты, deduplication и отрисовку сообщения Telegram и страницы Telegraph.
+Каждый запуск дописывается в benchmarks/results.jsonl и сравнивается с
+предыдущим запуском с теми же параметрами.
+
+Запуск: python benchmarks/bench_pipeline.py [--sizes 300,3000,30000] [--duplicate-rate 0.3]
+"""
+import argparse
+import datetime
+import io
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import zlib
+
+import pandas as pd
+
+BENCHMARKS_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(BENCHMARKS_DIRECTORY))
+
+from classification import CATEGORIES  # noqa: E402
+from deduplication import deduplication  # noqa: E402
+from feeds import iter_feed_items  # noqa: E402
+from rendering import render_digest  # noqa: E402
+from synthetic_feed import synthetic_feed  # noqa: E402
+
+RESULTS_FILE = os.path.join(BENCHMARKS_DIRECTORY, "results.jsonl")
+DEFAULT_SIZES = [300, 3000, 30000]
+DAY = datetime.date(2024, 1, 15)
+
+
+def stub_categories(headlines: list) -> list:
+    # Заглушка вместо LLM: детерминированная категория по хэшу заголовка
+    return [CATEGORIES[zlib.crc32(headline.encode('utf-8')) % len(CATEGORIES)] for headline in headlines]
+
+
+def parse(feed: bytes):
+    items = list(iter_feed_items(io.BytesIO(feed), DAY, DAY))
+    data = pd.DataFrame(items, columns=['headline', 'link', 'pubDate', 'description'])
+    return data.drop(columns=['pubDate'])
+
+
+def timed(function, *args):
+    started = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - started
+
+
+def run_once(feed: bytes) -> dict:
+    timings = {}
+    data, timings['parse'] = timed(parse, feed)
+    data['category'] = stub_categories(data['headline'].tolist())
+    result, timings['deduplication'] = timed(deduplication, data)
+    _, timings['render'] = timed(render_digest, result)
+    timings['items'] = len(data)
+    timings['groups'] = len(result)
+    return timings
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCHMARKS_DIRECTORY,
+                                       stderr=subprocess.DEVNULL).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ''
+
+
+def previous_results() -> list:
+    if not os.path.exists(RESULTS_FILE):
+        return []
+    with open(RESULTS_FILE, 'r') as file:
+        return [json.loads(line) for line in file if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--sizes', default=','.join(map(str, DEFAULT_SIZES)),
+                        help="размеры лент через запятую")
+    parser.add_argument('--duplicate-rate', type=float, default=0.3, help="доля перефразированных дублей")
+    parser.add_argument('--repeat', type=int, default=3, help="число повторов, берётся лучшее время")
+    parser.add_argument('--no-save', action='store_true', help="не записывать результат в results.jsonl")
+    args = parser.parse_args()
+
+    history = previous_results()
+    stages = ['parse', 'deduplication', 'render']
+    print(f"{'n':>7} " + " ".join(f"{stage:>16}" for stage in stages) + f" {'групп':>7}")
+    for size in [int(size) for size in args.sizes.split(',')]:
+        feed = synthetic_feed(size, args.duplicate_rate, day=DAY)
+        runs = [run_once(feed) for _ in range(args.repeat)]
+        best = {stage: min(run[stage] for run in runs) for stage in stages}
+        entry = {
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'size': size,
+            'duplicate_rate': args.duplicate_rate,
+            'items': runs[0]['items'],
+            'groups': runs[0]['groups'],
+            'seconds': best,
+        }
+        previous = next((item for item in reversed(history)
+                         if item['size'] == size and item['duplicate_rate'] == args.duplicate_rate), None)
+
+        cells = []
+        for stage in stages:
+            cell = f"{best[stage] * 1000:.1f} мс"
+            if previous and previous['seconds'].get(stage):
+                change = (best[stage] / previous['seconds'][stage] - 1) * 100
+                cell += f" {change:+.0f}%"
+            cells.append(f"{cell:>16}")
+        print(f"{size:>7} " + " ".join(cells) + f" {entry['groups']:>7}")
+
+        if not args.no_save:
+            with open(RESULTS_FILE, 'a') as file:
+                file.write(json.dumps(entry, ensure_ascii=False) + "\n")
+    if history:
+        print(f"Изменения в % - относительно прошлого запуска из {os.path.relpath(RESULTS_FILE)}")
+
+
+if __name__ == '__main__':
+    main()
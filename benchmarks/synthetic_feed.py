@@ -0,0 +1,72 @@
+# coding: utf-8
+"""Синтетические заголовки и RSS-ленты для офлайн-бенчмарков."""
+import datetime
+import random
+from email.utils import format_datetime
+from xml.sax.saxutils import escape
+
+STOP_WORDS = "на по из за для от до при как что это не его об".split()
+SYLLABLES = "ба ве ги до ку ле ми но па ро си те ул фа хо це чи ша эр юн яр ст пр кр ан ов ин".split()
+
+
+def make_vocabulary(size: int, rng: random.Random) -> list:
+    return list({''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(size)})
+
+
+def synthetic_headlines(n: int, duplicate_rate: float = 0.3, vocabulary_size: int = 20000, seed: int = 0) -> list:
+    """Заголовки со словами по закону Ципфа и долей перефразированных дублей duplicate_rate."""
+    rng = random.Random(seed)
+    vocabulary = make_vocabulary(vocabulary_size, rng)
+    weights = [1 / rank for rank in range(1, len(vocabulary) + 1)]
+    headlines = []
+    for _ in range(n):
+        if headlines and rng.random() < duplicate_rate:
+            # Перефразированный дубль: тот же заголовок с заменой одного слова
+            words = rng.choice(headlines).split()
+            words[rng.randrange(len(words))] = rng.choice(vocabulary)
+            headlines.append(' '.join(words))
+        else:
+            words = rng.choices(vocabulary, weights, k=rng.randint(5, 10)) + rng.sample(STOP_WORDS, 2)
+            rng.shuffle(words)
+            headlines.append(' '.join(words))
+    return headlines
+
+
+DOMAINS = ["n1info.rs", "rts.rs", "b92.net", "politika.rs", "meduza.io", "bbc.com", "reuters.com", "techcrunch.com"]
+
+
+def synthetic_feed(n: int, duplicate_rate: float = 0.3, day: datetime.date = None, old_share: float = 0.1,
+                   seed: int = 0) -> bytes:
+    """RSS 2.0 в формате, который разбирает fetch_and_parse_rss_feed.
+
+    n элементов за день day (от новых к старым, как в настоящей ленте) и ещё
+    old_share * n элементов за предыдущий день, чтобы проверялась отсечка по дате.
+    """
+    rng = random.Random(seed)
+    day = day or datetime.date.today()
+    n_old = int(n * old_share)
+    headlines = synthetic_headlines(n + n_old, duplicate_rate, seed=seed)
+    end_of_day = datetime.datetime.combine(day, datetime.time(23, 59), tzinfo=datetime.timezone.utc)
+    step = datetime.timedelta(seconds=86000 / max(n, 1))
+
+    items = []
+    for i, headline in enumerate(headlines):
+        if i < n:
+            published = end_of_day - step * i
+        else:
+            published = end_of_day - datetime.timedelta(days=1) - step * (i - n)
+        link = f"https://{rng.choice(DOMAINS)}/news/{seed}-{i}"
+        items.append(
+            "<item>"
+            f"<title>{escape(headline)}</title>"
+            f"<link>{escape(link)}</link>"
+            f"<pubDate>{format_datetime(published)}</pubDate>"
+            f"<description>{escape(headline)}</description>"
+            "</item>"
+        )
+    return (
+        '<?xml version="1.0" encoding="UTF-8"?>'
+        '<rss version="2.0"><channel><title>Synthetic feed</title><link>https://example.com</link>'
+        + "".join(items) +
+        "</channel></rss>"
+    ).encode("utf-8")
@@ -0,0 +1,85 @@
+# coding: utf-8
+"""Контрольные точки этапов одного запуска.
+
+Результат каждого завершённого этапа (загруженные заголовки, ответ LLM,
+сообщения Telegram, категории) сохраняется в checkpoints/<конвейер>_<дата>/<этап>.json,
+а у запусков по расписанию с несколькими слотами в день - в
+checkpoints/<конвейер>_<слот>_<дата>/<этап>.json.
+Повтор после сбоя или ручной перезапуск в тот же день продолжает с первого
+незавершённого этапа вместо повторной загрузки лент и запросов к LLM.
+Флаг --fresh начинает запуск заново.
+"""
+import datetime
+import json
+import os
+import re
+import shutil
+import sys
+from typing import Callable, Optional
+
+from files import atomic_write
+
+# Сколько дней хранить контрольные точки старых запусков
+RETENTION_DAYS = 7
+_MISSING = object()
+DATE = re.compile(r'\d{4}-\d{2}-\d{2}')
+
+
+def fresh_requested() -> bool:
+    return '--fresh' in sys.argv
+
+
+class Checkpoints:
+    def __init__(self, directory: str, pipeline: str, day: Optional[datetime.date] = None,
+                 fresh: Optional[bool] = None, retention_days: int = RETENTION_DAYS, run: Optional[str] = None):
+        self.root = directory
+        self.day = day or datetime.datetime.now().date()
+        # Несколько запусков в день (слоты scheduler.py) ведут отдельные точки
+        name = f"{pipeline}_{run}" if run else pipeline
+        self.path = os.path.join(directory, f"{name}_{self.day.isoformat()}")
+        if fresh_requested() if fresh is None else fresh:
+            self.clear()
+        os.makedirs(self.path, exist_ok=True)
+        self.prune(pipeline, retention_days)
+
+    def _file(self, stage: str) -> str:
+        return os.path.join(self.path, f"{stage}.json")
+
+    def get(self, stage: str, default=None):
+        try:
+            with open(self._file(stage), 'r') as file:
+                return json.load(file)
+        except (OSError, ValueError):
+            # Недописанная или повреждённая точка равносильна её отсутствию
+            return default
+
+    def done(self, stage: str) -> bool:
+        return self.get(stage, _MISSING) is not _MISSING
+
+    def put(self, stage: str, value):
+        # Сбой посреди записи не должен оставить битую точку
+        with atomic_write(self._file(stage)) as file:
+            json.dump(value, file, ensure_ascii=False, default=str)
+        return value
+
+    def stage(self, stage: str, compute: Callable):
+        """Результат этапа из контрольной точки или, если её нет, вычисленный и сохранённый."""
+        value = self.get(stage, _MISSING)
+        if value is _MISSING:
+            value = self.put(stage, compute())
+        else:
+            print(f"Этап {stage}: взят из контрольной точки {os.path.relpath(self._file(stage))}")
+        return value
+
+    def clear(self):
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def prune(self, pipeline: str, retention_days: int):
+        oldest = (self.day - datetime.timedelta(days=retention_days)).isoformat()
+        prefix = f"{pipeline}_"
+        for name in os.listdir(self.root):
+            # Имена вида <конвейер>[_<слот>]_ГГГГ-ММ-ДД, даты сравниваются как строки
+            day = name[-10:]
+            if (name.startswith(prefix) and len(name) >= len(prefix) + 10 and DATE.fullmatch(day)
+                    and day < oldest):
+                shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
@@ -0,0 +1,220 @@
+# coding: utf-8
+import collections
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import TYPE_CHECKING, Optional
+
+from openai import OpenAI
+
+from classification_cache import ClassificationCache, normalize_headline
+from llm_backend import CLIENT_TIMEOUT, RETRYABLE_ERRORS, get_client, retry_delay
+from llm_usage import BudgetExceeded, response_usage, usage
+
+if TYPE_CHECKING:
+    from local_classifier import LocalClassifier
+
+MODEL = "gpt-4-0125-preview"
+# Увеличивайте при изменении промптов или списка категорий, чтобы не брать старые ответы из кэша
+PROMPT_VERSION = '1'
+CATEGORIES = ['Бизнес', 'Технологии', 'Наука', 'Сербия', 'Другое']
+SYSTEM_PROMPT = "В ответе должно быть только одна категория из этих: " + ", ".join(CATEGORIES)
+HEADLINE_PROMPT = "Определите одну наилучшую категорию для заголовка новости: "
+BATCH_SYSTEM_PROMPT = (
+    "Определи одну наилучшую категорию для каждого заголовка новости. "
+    "Допустимые категории: " + ", ".join(CATEGORIES) + ". "
+    "Ответ верни в формате JSON-объекта, где ключ - номер заголовка, а значение - категория, "
+    'например {"0": "Наука", "1": "Другое"}.'
+)
+FALLBACK_CATEGORY = 'Другое'
+
+# Ограничения по умолчанию для параллельной классификации
+BATCH_SIZE = 20
+MAX_REASKS = 2
+MAX_IN_FLIGHT = 8
+MAX_RETRIES = 5
+
+
+def _complete(client: OpenAI, messages: list, max_retries: int = MAX_RETRIES, model: str = MODEL,
+              stage: str = 'classify', **kwargs) -> tuple:
+    """Возвращает (ответ, модель, которая его дала).
+
+    Модель выбирается перед каждым запросом по уже потраченному бюджету,
+    когда бюджет исчерпан - BudgetExceeded.
+    """
+    for attempt in range(max_retries + 1):
+        request_model = usage.model_for(model)
+        try:
+            # Каждая попытка учитывается отдельно, чтобы были видны ошибки и хвост задержек
+            with usage.call(stage, request_model) as call:
+                response = client.chat.completions.create(model=request_model, messages=messages, **kwargs)
+                call.usage(*response_usage(response))
+            break
+        except RETRYABLE_ERRORS as e:
+            if attempt == max_retries:
+                raise
+            time.sleep(retry_delay(e, attempt))
+
+    # Ответ может прийти как словарём, так и объектом
+    if isinstance(response, dict):
+        return response['choices'][0]['message']['content'], request_model
+    return response.choices[0].message.content, request_model
+
+
+def normalize_category(value) -> Optional[str]:
+    """Приводит ответ модели к одной из CATEGORIES или возвращает None."""
+    if not isinstance(value, str):
+        return None
+    value = value.strip().strip('."\'').lower()
+    for category in CATEGORIES:
+        if category.lower() == value:
+            return category
+    return None
+
+
+def process_with_gpt(text: str, client: OpenAI, model: str = MODEL) -> tuple:
+    return _complete(client, [
+        {"role": "system", "content": SYSTEM_PROMPT},
+        {"role": "user", "content": text},
+    ], model=model)
+
+
+def process_batch_with_gpt(headlines: list, client: OpenAI, max_reasks: int = MAX_REASKS,
+                           model: str = MODEL) -> tuple:
+    """Классифицирует несколько заголовков одним запросом со структурированным (JSON) ответом.
+
+    Заголовки, для которых модель не вернула допустимую категорию, переспрашиваются
+    отдельным запросом; если это не помогло, им назначается FALLBACK_CATEGORY.
+    Возвращает (категории, модель последнего ответа).
+    """
+    categories = [None] * len(headlines)
+    answered_by = model
+    pending = list(range(len(headlines)))
+    for _ in range(max_reasks + 1):
+        if not pending:
+            break
+        # Нумерация в запросе локальная, чтобы переспрос был таким же коротким
+        prompt = "\n".join(f"{i}: {headlines[index]}" for i, index in enumerate(pending))
+        content, answered_by = _complete(client, [
+            {"role": "system", "content": BATCH_SYSTEM_PROMPT},
+            {"role": "user", "content": prompt},
+        ], model=model, stage='classify' if len(pending) == len(headlines) else 'classify_reask',
+            response_format={"type": "json_object"})
+        try:
+            answer = json.loads(content)
+        except (TypeError, ValueError):
+            answer = {}
+        if not isinstance(answer, dict):
+            answer = {}
+        for i, index in enumerate(pending):
+            categories[index] = normalize_category(answer.get(str(i)))
+        pending = [index for index in pending if categories[index] is None]
+
+    return [category or FALLBACK_CATEGORY for category in categories], answered_by
+
+
+def _classify(input_texts: list, client: OpenAI, batch_size: int, max_in_flight: int, model: str = MODEL) -> list:
+    """Пары (категория, ответившая модель) по заголовкам; (None, None) - пакет не успел до конца бюджета."""
+    def classify(batch):
+        if batch_size > 1:
+            return process_batch_with_gpt(batch, client, model=model)
+        category, answered_by = process_with_gpt(HEADLINE_PROMPT + batch[0], client, model=model)
+        return [category], answered_by
+
+    def worker(batch):
+        try:
+            categories, answered_by = classify(batch)
+        except BudgetExceeded:
+            # Оплаченные ответы остальных пакетов сохраняются
+            return [(None, None)] * len(batch)
+        return [(category, answered_by) for category in categories]
+
+    batches = [input_texts[i:i + max(batch_size, 1)] for i in range(0, len(input_texts), max(batch_size, 1))]
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_in_flight, len(batches)))) as executor:
+        # executor.map возвращает результаты в порядке входных данных
+        return [result for batch in executor.map(worker, batches) for result in batch]
+
+
+def generate_summary_batch(input_texts: list, api_key: str, batch_size: int = BATCH_SIZE,
+                           max_in_flight: int = MAX_IN_FLIGHT, timeout: float = CLIENT_TIMEOUT,
+                           cache: Optional[ClassificationCache] = None,
+                           local_classifier: Optional['LocalClassifier'] = None,
+                           base_url: Optional[str] = None, stats: Optional[collections.Counter] = None) -> list:
+    """Классифицирует заголовки параллельно, не более max_in_flight запросов одновременно.
+
+    При batch_size > 1 в одном запросе классифицируется сразу batch_size заголовков,
+    при batch_size == 1 на каждый заголовок уходит отдельный запрос.
+    Заголовки, найденные в cache или уверенно распознанные local_classifier,
+    в модель не отправляются; если API недоступно, для остальных берётся
+    лучший ответ локальной модели. Порядок результатов совпадает с порядком input_texts.
+    Когда потрачена часть бюджета на LLM, запросы идут в дешёвую модель, а когда
+    бюджет исчерпан - остальные заголовки получают ответ локальной модели или FALLBACK_CATEGORY.
+    В stats добавляется, сколько различных заголовков ушло в LLM ('llm') и скольким
+    из них вместо ответа LLM достался упрощённый режим ('fallback').
+    """
+    stats = collections.Counter() if stats is None else stats
+    if not input_texts:
+        return []
+    if cache is not None:
+        summaries = cache.get_many(input_texts, MODEL, PROMPT_VERSION)
+    else:
+        summaries = [None] * len(input_texts)
+
+    # Одинаковые заголовки классифицируем только один раз
+    pending = {}
+    for index, text in enumerate(input_texts):
+        if summaries[index] is None:
+            pending.setdefault(normalize_headline(text), []).append(index)
+
+    def assign(indexes_list, results):
+        for indexes, result in zip(indexes_list, results):
+            for index in indexes:
+                summaries[index] = result
+
+    usage.record_cache_hits('classify', len(input_texts) - sum(len(indexes) for indexes in pending.values()))
+    local_ready = local_classifier is not None and local_classifier.trained
+    if pending and local_ready:
+        groups = list(pending.values())
+        local_results = local_classifier.classify([input_texts[indexes[0]] for indexes in groups])
+        assign(groups, local_results)
+        usage.record_cache_hits('classify', sum(len(indexes) for indexes, result in zip(groups, local_results)
+                                                if result is not None), source='local')
+        pending = {key: indexes for (key, indexes), result in zip(pending.items(), local_results) if result is None}
+    if not pending:
+        return summaries
+
+    groups = list(pending.values())
+    texts = [input_texts[indexes[0]] for indexes in groups]
+    stats['llm'] += len(texts)
+    try:
+        results = _classify(texts, get_client(api_key, timeout, base_url), batch_size, max_in_flight, MODEL)
+    except RETRYABLE_ERRORS as e:
+        if not local_ready:
+            raise
+        print(f"LLM недоступна ({e}), используется локальный классификатор")
+        assign(groups, local_classifier.predict(texts)[0])
+        stats['fallback'] += len(texts)
+        return summaries
+    assign(groups, [category for category, _ in results])
+
+    if cache is not None:
+        # В кэш попадают только ответы LLM из допустимого списка категорий. Ключ - основная модель,
+        # чтобы ответы дешёвой модели находились следующими запусками и шли в обучение локальной
+        answered = collections.defaultdict(list)
+        for text, (category, answered_by) in zip(texts, results):
+            if normalize_category(category) is not None:
+                answered[answered_by].append((text, normalize_category(category)))
+        for answered_by, items in answered.items():
+            cache.put_many(items, MODEL, PROMPT_VERSION, answered_by=answered_by)
+
+    # Пакеты, не успевшие до исчерпания бюджета, получают ответ локальной модели или FALLBACK_CATEGORY
+    unfinished = [position for position, (category, _) in enumerate(results) if category is None]
+    if unfinished:
+        print(f"Бюджет на LLM исчерпан, {len(unfinished)} заголовков классифицировано в упрощённом режиме")
+        unfinished_texts = [texts[position] for position in unfinished]
+        stats['fallback'] += len(unfinished_texts)
+        assign([groups[position] for position in unfinished],
+               local_classifier.predict(unfinished_texts)[0] if local_ready
+               else [FALLBACK_CATEGORY] * len(unfinished_texts))
+    return summaries
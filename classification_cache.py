@@ -0,0 +1,163 @@
+# coding: utf-8
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+from typing import Optional
+
+# Время жизни записи и максимальный размер кэша по умолчанию
+CACHE_TTL = 30 * 24 * 3600
+CACHE_MAX_ENTRIES = 50000
+# Сколько ждать блокировку базы, пока в неё пишет другой процесс (backfill)
+CACHE_BUSY_TIMEOUT = 30
+
+
+def normalize_headline(headline: str) -> str:
+    return ' '.join(headline.lower().split())
+
+
+class ClassificationCache:
+    """Кэш категорий заголовков в SQLite.
+
+    Ключ - нормализованный заголовок, имя модели и версия промпта, так что смена
+    модели или промпта автоматически инвалидирует старые ответы. Модель ключа -
+    основная модель конвейера; если при экономии бюджета ответила более дешёвая,
+    её имя хранится отдельно в answered_by и на поиск не влияет.
+    """
+
+    def __init__(self, path: str, ttl: float = CACHE_TTL, max_entries: int = CACHE_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        directory = os.path.dirname(os.path.abspath(path))
+        os.makedirs(directory, exist_ok=True)
+        self._connection = sqlite3.connect(path, timeout=CACHE_BUSY_TIMEOUT, check_same_thread=False)
+        # WAL: читатели не ждут писателя, а процессы пула backfill пишут в один файл по очереди
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS classifications ("
+            " key TEXT PRIMARY KEY,"
+            " headline TEXT NOT NULL,"
+            " model TEXT NOT NULL,"
+            " prompt_version TEXT NOT NULL,"
+            " category TEXT NOT NULL,"
+            " created_at REAL NOT NULL,"
+            " last_used REAL NOT NULL,"
+            " answered_by TEXT)"
+        )
+        columns = {row[1] for row in self._connection.execute("PRAGMA table_info(classifications)")}
+        if 'answered_by' not in columns:
+            # Кэш, созданный до появления столбца
+            self._connection.execute("ALTER TABLE classifications ADD COLUMN answered_by TEXT")
+        self._connection.execute(
+            "CREATE INDEX IF NOT EXISTS classifications_last_used ON classifications (last_used)"
+        )
+        self._connection.commit()
+        self.evict()
+
+    @staticmethod
+    def make_key(headline: str, model: str, prompt_version: str) -> str:
+        raw = '\x1f'.join([normalize_headline(headline), model, prompt_version])
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get_many(self, headlines: list, model: str, prompt_version: str) -> list:
+        """Возвращает категории для заголовков в том же порядке, None - если записи нет."""
+        keys = [self.make_key(headline, model, prompt_version) for headline in headlines]
+        found = {}
+        now = time.time()
+        with self._lock:
+            unique_keys = list(set(keys))
+            # SQLite ограничивает число параметров в запросе, поэтому читаем кусками
+            for i in range(0, len(unique_keys), 500):
+                chunk = unique_keys[i:i + 500]
+                placeholders = ','.join('?' * len(chunk))
+                rows = self._connection.execute(
+                    f"SELECT key, category FROM classifications WHERE key IN ({placeholders}) AND created_at >= ?",
+                    chunk + [now - self.ttl],
+                ).fetchall()
+                found.update(rows)
+            if found:
+                self._connection.executemany(
+                    "UPDATE classifications SET last_used = ? WHERE key = ?",
+                    [(now, key) for key in found],
+                )
+                self._connection.commit()
+            categories = [found.get(key) for key in keys]
+            hits = sum(category is not None for category in categories)
+            self.hits += hits
+            self.misses += len(categories) - hits
+        return categories
+
+    def get(self, headline: str, model: str, prompt_version: str) -> Optional[str]:
+        return self.get_many([headline], model, prompt_version)[0]
+
+    def put_many(self, items: list, model: str, prompt_version: str, answered_by: Optional[str] = None):
+        """Сохраняет пары (заголовок, категория); answered_by - модель, давшая ответ, если это не model."""
+        now = time.time()
+        rows = [(self.make_key(headline, model, prompt_version), headline, model, prompt_version, category, now, now,
+                 answered_by or model)
+                for headline, category in items]
+        with self._lock:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO classifications"
+                " (key, headline, model, prompt_version, category, created_at, last_used, answered_by)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                rows,
+            )
+            self._connection.commit()
+        self.evict()
+
+    def put(self, headline: str, category: str, model: str, prompt_version: str):
+        self.put_many([(headline, category)], model, prompt_version)
+
+    def labeled_pairs(self, model: str, prompt_version: str) -> list:
+        """Все непросроченные пары (заголовок, категория) - обучающие данные для локального классификатора."""
+        with self._lock:
+            return self._connection.execute(
+                "SELECT headline, category FROM classifications"
+                " WHERE model = ? AND prompt_version = ? AND created_at >= ?",
+                (model, prompt_version, time.time() - self.ttl),
+            ).fetchall()
+
+    def newest_label(self, model: str, prompt_version: str) -> float:
+        """Время самой свежей записи модели и версии промпта, 0.0 - если записей нет."""
+        with self._lock:
+            newest = self._connection.execute(
+                "SELECT MAX(created_at) FROM classifications WHERE model = ? AND prompt_version = ?",
+                (model, prompt_version),
+            ).fetchone()[0]
+        return newest or 0.0
+
+    def evict(self):
+        """Удаляет просроченные записи и самые давно использованные сверх max_entries."""
+        with self._lock:
+            self._connection.execute("DELETE FROM classifications WHERE created_at < ?", (time.time() - self.ttl,))
+            count = self._connection.execute("SELECT COUNT(*) FROM classifications").fetchone()[0]
+            if count > self.max_entries:
+                self._connection.execute(
+                    "DELETE FROM classifications WHERE key IN"
+                    " (SELECT key FROM classifications ORDER BY last_used LIMIT ?)",
+                    (count - self.max_entries,),
+                )
+            self._connection.commit()
+
+    def __len__(self):
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM classifications").fetchone()[0]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+            'entries': len(self),
+        }
+
+    def close(self):
+        with self._lock:
+            self._connection.close()
@@ -0,0 +1,151 @@
+# coding: utf-8
+"""Единая конфигурация для всех скриптов.
+
+Значения собираются один раз за процесс из трёх слоёв, каждый следующий
+переопределяет предыдущий:
+
+1. config.json рядом со скриптами (на VPS);
+2. переменные окружения с теми же именами, что и ключи (GitHub Actions);
+3. аргументы командной строки вида KEY=VALUE.
+
+Под ними лежат значения по умолчанию из DEFAULTS.
+"""
+import functools
+import json
+import os
+import sys
+from typing import Optional
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "config.json")
+
+# Значения по умолчанию; адреса API можно направить на локальный mock_server.py
+DEFAULTS = {
+    "openai_base_url": None,
+    "telegram_api_url": "https://api.telegram.org",
+    "telegraph_api_url": "https://api.telegra.ph",
+    # Сколько сообщений Telegram допустимо для длинного дайджеста, прежде чем уйти в Telegraph
+    "max_telegram_messages": 1,
+    # Получатели дайджеста со своими фильтрами и шаблонами, см. subscribers.py
+    "subscribers": [],
+    # Показывать сводку main.py/mainGemini.py в Telegram по мере генерации
+    "stream_summary": False,
+    # Бюджет на LLM за запуск, см. llm_usage.py
+    "llm_budget_usd": None,
+    "llm_downgrade_share": 0.5,
+    "llm_fallback_model": None,
+    "llm_prices": {},
+    # Провайдеры сводки в порядке предпочтения и их модели, см. llm_backend.py
+    "llm_providers": None,
+    "llm_models": {},
+    "llm_hedge": False,
+    # Расписание scheduler.py: {"digest:prod": "07:30", "main": ["09:00", "21:00"]}
+    "schedule": {},
+    "health_host": "127.0.0.1",
+    "health_port": 8081,
+    # Файл для textfile-коллектора node_exporter, см. metrics.py; None - не писать
+    "metrics_textfile": None,
+}
+
+# Ключи, которые можно задать через переменные окружения, даже если их нет в config.json
+ENV_KEYS = (
+    "TELEGRAM_BOT_TOKEN",
+    "TELEGRAM_CHAT_ID",
+    "TEST_TELEGRAM_CHAT_ID",
+    "TELEGRAPH_ACCESS_TOKEN",
+    "openai_token",
+    "feed_url",
+    "feed_urls",
+    "project_id",
+    "region",
+    "openai_base_url",
+    "telegram_api_url",
+    "telegraph_api_url",
+    "max_telegram_messages",
+    "subscribers",
+    "stream_summary",
+    "llm_budget_usd",
+    "llm_downgrade_share",
+    "llm_fallback_model",
+    "llm_prices",
+    "llm_providers",
+    "llm_models",
+    "llm_hedge",
+    "schedule",
+    "health_host",
+    "health_port",
+    "metrics_textfile",
+)
+
+
+def parse_value(value: str):
+    """Строки из окружения и командной строки, похожие на JSON-списки/объекты, разбираются как JSON."""
+    stripped = value.strip()
+    if stripped[:1] in ('[', '{'):
+        try:
+            return json.loads(stripped)
+        except ValueError:
+            pass
+    return value
+
+
+def split_arguments(argv: list) -> tuple:
+    """Делит аргументы командной строки на позиционные и переопределения KEY=VALUE.
+
+    Флаги вида --name относятся к самим скриптам и пропускаются.
+    """
+    positional, overrides = [], {}
+    for argument in argv:
+        if argument.startswith('-'):
+            continue
+        key, separator, value = argument.partition('=')
+        if separator and key:
+            overrides[key] = parse_value(value)
+        else:
+            positional.append(argument)
+    return positional, overrides
+
+
+def cli_arguments() -> list:
+    """Позиционные аргументы скрипта без переопределений конфигурации."""
+    return split_arguments(sys.argv[1:])[0]
+
+
+@functools.lru_cache(maxsize=None)
+def get_config() -> dict:
+    config = dict(DEFAULTS)
+    if os.path.exists(CONFIG_FILE):
+        with open(CONFIG_FILE, "r") as file:
+            config.update(json.load(file))
+
+    for key in set(ENV_KEYS) | set(config):
+        value = os.getenv(key)
+        if value is not None:
+            config[key] = parse_value(value)
+
+    config.update(split_arguments(sys.argv[1:])[1])
+    return config
+
+
+def load_config(key: Optional[str] = None):
+    config = get_config()
+    if key:
+        if key not in config:
+            raise KeyError(f"The key '{key}' was not found in the config file or environment.")
+        return config[key]  # Возвращаем значение заданного ключа
+    else:
+        return config  # Возвращаем весь конфигурационный словарь
+
+
+def config_flag(key: str) -> bool:
+    """Булев ключ: true/1/yes из окружения и командной строки приходят строками."""
+    value = get_config().get(key, False)
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+
+def validate_config(required: tuple):
+    """Проверяет сразу все обязательные ключи, чтобы ошибка конфигурации всплывала до начала работы."""
+    missing = [key for key in required if key not in get_config()]
+    if missing:
+        raise KeyError(f"Missing required config keys: {', '.join(missing)}")
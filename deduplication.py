@@ -0,0 +1,120 @@
+# coding: utf-8
+import numpy as np
+import pandas as pd
+from scipy.sparse import coo_matrix, csr_matrix
+from scipy.sparse.csgraph import connected_components
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+SIMILARITY_THRESHOLD = 0.5
+# Число строк, для которых сходство считается за один шаг
+BLOCK_SIZE = 1024
+
+
+def index_features(matrix: csr_matrix, threshold: float) -> csr_matrix:
+    """Оставляет в каждой строке только признаки, по которым нужно искать кандидатов.
+
+    Признаки упорядочиваются глобально от частых к редким, и из каждой строки
+    выбрасывается самый длинный префикс частых признаков с нормой не больше
+    threshold. Если у двух нормированных строк нет общего оставшегося признака,
+    все их общие признаки лежат в выброшенном префиксе одной из них, и по
+    неравенству Коши-Буняковского их сходство не превышает threshold. Поэтому
+    пары со сходством выше порога всегда делят хотя бы один оставшийся признак,
+    а частые слова (предлоги, союзы) не порождают кандидатов.
+    """
+    document_frequency = np.bincount(matrix.indices, minlength=matrix.shape[1])
+    # Ранг признака: 0 - самый частый
+    rank = np.empty_like(document_frequency)
+    rank[np.argsort(-document_frequency, kind='stable')] = np.arange(len(document_frequency))
+
+    row_of_entry = np.repeat(np.arange(matrix.shape[0]), np.diff(matrix.indptr))
+    order = np.lexsort((rank[matrix.indices], row_of_entry))
+    squares = matrix.data[order] ** 2
+    cumulative = np.cumsum(squares)
+    # Накопленная сумма квадратов внутри каждой строки
+    row_start = matrix.indptr[:-1][row_of_entry[order]]
+    cumulative -= np.concatenate(([0.0], cumulative))[row_start]
+    keep = np.empty(len(order), dtype=bool)
+    keep[order] = np.sqrt(cumulative) > threshold
+
+    indexed = matrix.copy()
+    indexed.data = np.where(keep, 1.0, 0.0)
+    indexed.eliminate_zeros()
+    return indexed
+
+
+def similarity_graph(matrix: csr_matrix, threshold: float = SIMILARITY_THRESHOLD,
+                     block_size: int = BLOCK_SIZE) -> csr_matrix:
+    """Разреженный граф пар строк с косинусным сходством выше threshold.
+
+    Строки matrix должны быть нормированы (как у TfidfVectorizer), тогда
+    косинусное сходство - это просто скалярное произведение. Кандидаты ищутся
+    блоками по block_size строк только по признакам из index_features, и для
+    них считается точное сходство, так что плотная матрица n x n не строится,
+    а память ограничена размером блока и числом найденных пар. Граф
+    неориентированный, поэтому для каждого блока берутся только столбцы начиная
+    с его первой строки (верхний треугольник).
+    """
+    matrix = csr_matrix(matrix, dtype=np.float64)
+    n = matrix.shape[0]
+    indexed = index_features(matrix, threshold)
+    indexed_transposed = indexed.T.tocsc()
+    rows, cols = [], []
+    for start in range(0, n, block_size):
+        candidates = (indexed[start:start + block_size] @ indexed_transposed[:, start:]).tocoo()
+        candidate_rows = candidates.row + start
+        candidate_cols = candidates.col + start
+        # Точное сходство только для пар-кандидатов
+        similarity = np.asarray(matrix[candidate_rows].multiply(matrix[candidate_cols]).sum(axis=1)).ravel()
+        mask = similarity > threshold
+        rows.append(candidate_rows[mask])
+        cols.append(candidate_cols[mask])
+    # Каждая непустая строка похожа сама на себя, как и в плотной матрице
+    self_loops = np.flatnonzero(np.diff(matrix.indptr) > 0)
+    rows.append(self_loops)
+    cols.append(self_loops)
+    rows = np.concatenate(rows)
+    cols = np.concatenate(cols)
+    return coo_matrix((np.ones(len(rows), dtype=bool), (rows, cols)), shape=(n, n)).tocsr()
+
+
+def deduplication(data, threshold: float = SIMILARITY_THRESHOLD, block_size: int = BLOCK_SIZE,
+                  story_index=None, seen_mode: str = 'update'):
+    """Объединяет похожие новости в группы.
+
+    Если передан story_index, группы, в которых есть заголовок, похожий на уже
+    отправленный в прошлые дни сюжет, при seen_mode == 'drop' удаляются, а при
+    seen_mode == 'update' помечаются в столбце is_update.
+    """
+    # Вычисление TF-IDF и разреженного графа похожих заголовков
+    tfidf_vectorizer = TfidfVectorizer()
+    tfidf_matrix = tfidf_vectorizer.fit_transform(data['headline'])
+
+    # Идентификация групп новостей
+    graph = similarity_graph(tfidf_matrix, threshold, block_size)
+    n_components, labels = connected_components(csgraph=graph, directed=False, return_labels=True)
+    data['group_id'] = labels
+
+    if story_index is not None:
+        # Сравниваем с индексом все заголовки, а не только самый длинный в группе
+        seen = pd.Series([match >= 0 for match in story_index.match(data['headline'].tolist())], index=data.index)
+        data['is_update'] = seen.groupby(data['group_id']).transform('any')
+        if seen_mode == 'drop':
+            data = data[~data['is_update']].drop(columns=['is_update'])
+
+    # Группировка данных по group_id и агрегация ссылок в списки
+    links_aggregated = data.groupby('group_id')['link'].agg(list).reset_index()
+
+    # Определение новости с самым длинным заголовком в каждой группе
+    longest_index = data['headline'].str.len().groupby(data['group_id']).idxmax()
+    longest_headlines = data.loc[longest_index]
+
+    # Объединение результатов, чтобы к каждой новости добавить список ссылок
+    result = pd.merge(longest_headlines, links_aggregated, on='group_id', how='left')
+
+    # Переименовываем колонки для ясности
+    result.rename(columns={'link_x': 'link', 'link_y': 'links'}, inplace=True)
+
+    # Удаление дубликатов, не включая столбец 'links'
+    cols_for_deduplication = [col for col in result.columns if col != 'links']
+    result = result.drop_duplicates(subset=cols_for_deduplication)
+    return result
@@ -0,0 +1,298 @@
+# coding: utf-8
+"""Общий конвейер дайджеста для non-gpt.py (VPS) и non-gpt_serverless.py (GitHub Actions)."""
+import collections
+import datetime
+import json
+import os
+from typing import Optional
+
+from checkpoints import Checkpoints
+from classification_cache import ClassificationCache
+from config import cli_arguments, load_config, validate_config
+from feeds import FeedState, fetch_feeds, parse_feed_urls
+from llm_usage import usage
+from local_classifier import LocalClassifier
+from metrics import RunMetrics
+from rendering import render_digest
+from telegram_delivery import chat_ids, get_sender
+from startup_profile import profiled
+from subscribers import load_subscribers
+
+# pandas, openai, scikit-learn, scipy и telegraph импортируются внутри этапов,
+# которым они нужны, чтобы не замедлять холодный старт
+
+
+# Ключи, без которых дайджест не собрать
+REQUIRED_KEYS = ("TELEGRAM_BOT_TOKEN", "TELEGRAM_CHAT_ID", "TEST_TELEGRAM_CHAT_ID", "TELEGRAPH_ACCESS_TOKEN",
+                 "openai_token")
+
+DEFAULT_FEED_URLS = ["https://s3.dzarlax.dev/feed_300.xml"]
+
+
+def fetch_and_parse_rss_feed(urls: list, day: datetime.date, state: Optional[FeedState] = None) -> tuple:
+    import pandas as pd
+
+    # Ленты скачиваются параллельно, в память попадают только элементы за нужный день
+    items, errors = fetch_feeds(urls, start=day, end=day, state=state)
+    return pd.DataFrame(items, columns=['headline', 'link', 'pubDate', 'description']), errors
+
+
+def items_for_day(data, day: datetime.date):
+    """Оставляет элементы, опубликованные ровно в day; столбец pubDate дальше не нужен."""
+    data['today'] = day
+    return data[data['pubDate'] == data['today']].drop(columns=['today', 'pubDate'])
+
+
+def classify_headlines(headlines: list, base_directory: str, metrics: RunMetrics,
+                       max_in_flight: Optional[int] = None) -> list:
+    """Категории заголовков: кэш, затем локальный классификатор, затем LLM.
+
+    max_in_flight - предел одновременных запросов к LLM, по умолчанию MAX_IN_FLIGHT.
+    """
+    from classification import MAX_IN_FLIGHT, generate_summary_batch
+
+    stats = collections.Counter()
+
+    cache = ClassificationCache(os.path.join(base_directory, "classification_cache.sqlite"))
+    local_classifier_path = os.path.join(base_directory, "local_classifier.pkl")
+    with profiled("LocalClassifier.load"):
+        local_classifier = LocalClassifier.load(local_classifier_path)
+    categories = generate_summary_batch(headlines, load_config("openai_token"), cache=cache,
+                                        local_classifier=local_classifier, base_url=load_config("openai_base_url"),
+                                        stats=stats, max_in_flight=max_in_flight or MAX_IN_FLIGHT)
+    metrics.extra['classification'] = dict(cache.stats(), local=local_classifier.answered, llm=stats['llm'],
+                                           fallback=stats['fallback'])
+    print(f"Кэш классификации: {cache.stats()}, локально: {local_classifier.answered}, в LLM: {stats['llm']}"
+          f", упрощённо: {stats['fallback']}")
+    cache.close()
+    return categories
+
+
+def train_local_classifier(base_directory: str, metrics: RunMetrics):
+    """Дообучает локальный классификатор на ответах LLM, если после прошлого обучения появились новые.
+
+    Вызывается после доставки: обучение на десятках тысяч пар занимает секунды.
+    """
+    from classification import MODEL, PROMPT_VERSION
+
+    cache = ClassificationCache(os.path.join(base_directory, "classification_cache.sqlite"))
+    local_classifier_path = os.path.join(base_directory, "local_classifier.pkl")
+    trained_at = os.path.getmtime(local_classifier_path) if os.path.exists(local_classifier_path) else 0.0
+    try:
+        # Время файла модели - момент прошлого обучения; без новых ответов LLM модель не меняется
+        if cache.newest_label(MODEL, PROMPT_VERSION) <= trained_at:
+            return
+        with metrics.stage('train') as stage:
+            pairs = cache.labeled_pairs(MODEL, PROMPT_VERSION)
+            stage.items_in = len(pairs)
+            local_classifier = LocalClassifier()
+            if local_classifier.fit(pairs):
+                local_classifier.save(local_classifier_path)
+                stage.items_out = len(pairs)
+    finally:
+        cache.close()
+
+
+def notify(message, chat_id, telegram_token):
+    # Служебные уведомления уходят в фоне и не задерживают конвейер; их дожидается job()
+    get_sender(telegram_token).submit(chat_id, message, disable_web_page_preview=False)
+
+
+def create_telegraph_page_with_library(content_html, access_token, telegram_token,
+                                       author_name="Dzarlax", author_url="https://dzarlax.dev"):
+    # Библиотека telegraph жёстко задаёт адрес API, поэтому от неё берём только
+    # преобразование HTML в узлы, а createPage вызываем сами по telegraph_api_url
+    from telegraph.utils import html_to_nodes
+
+    # Создание страницы на Telegra.ph через общий пул соединений, с таймаутом и повторами
+    response = get_sender(telegram_token).telegraph("createPage", {
+        "access_token": access_token,
+        "title": "Новости за " + str(datetime.datetime.now().date()),
+        "author_name": author_name,
+        "author_url": author_url,
+        "content": json.dumps(html_to_nodes(content_html), ensure_ascii=False),
+        "return_content": "false",
+    })
+    if not response.get('ok'):
+        raise Exception(f"Telegraph API вернул ошибку: {response.get('error')}")
+    return response['result']['url']
+
+
+def prepare_messages(result, subscribers: list, telegraph_access_token, telegram_token,
+                     metrics: Optional[RunMetrics] = None) -> dict:
+    """Сообщения каждого подписчика: {имя: [части]}.
+
+    Одинаковые выборки с одинаковым шаблоном отрисовываются один раз и делят одну страницу Telegraph.
+    """
+    metrics = metrics or RunMetrics('digest', '-')
+    categories = result['category'].tolist()
+    sizes = [len(links) for links in result['links'].tolist()]
+    keys = {subscriber.name: (subscriber.select(categories, sizes), subscriber.max_links)
+            for subscriber in subscribers}
+    rendered = {}
+    with metrics.stage('render', items_in=len(result)) as stage:
+        for key in dict.fromkeys(keys.values()):
+            positions, max_links = key
+            if positions:
+                rendered[key] = render_digest(result.iloc[list(positions)], max_links=max_links)
+        # Строки во всех различных отрисовках; длина сообщений - отдельно, в отчёте
+        stage.items_out = sum(digest.items for digest in rendered.values())
+    metrics.extra['telegram_length'] = sum(digest.telegram_length for digest in rendered.values())
+
+    # Длинный дайджест делится по границам категорий и новостей на части до 4096 символов
+    messages = {}
+    for subscriber in subscribers:
+        key = keys[subscriber.name]
+        messages[subscriber.name] = rendered[key].telegram_chunks() if key in rendered else []
+    # Страница нужна подписчику по его собственному шаблону и лимиту сообщений;
+    # подписчики с той же выборкой, которым хватает сообщений, получают их как есть
+    readers = [subscriber for subscriber in subscribers if keys[subscriber.name] in rendered
+               and (subscriber.template == 'telegraph'
+                    or len(messages[subscriber.name]) > subscriber.max_telegram_messages)]
+    to_telegraph = {keys[subscriber.name] for subscriber in readers}
+    if to_telegraph:
+        with metrics.stage('telegraph', items_in=len(to_telegraph)):
+            pages = {key: create_telegraph_page_with_library(rendered[key].telegraph, telegraph_access_token,
+                                                             telegram_token)
+                     for key in to_telegraph}
+        for subscriber in readers:
+            messages[subscriber.name] = [
+                f"Сегодня много новостей, поэтому они спрятаны по ссылочке: {pages[keys[subscriber.name]]}"]
+    return messages
+
+
+def send_to_subscribers(messages: dict, subscribers: list, telegram_token,
+                        metrics: Optional[RunMetrics] = None) -> dict:
+    """Отправляет всем подписчикам одной рассылкой и возвращает {имя: ответ}.
+
+    Чаты получают сообщения параллельно, части в каждом чате идут по порядку.
+    Ответ подписчика - первая неудачная часть или последняя отправленная.
+    """
+    metrics = metrics or RunMetrics('digest', '-')
+    # В chat_id подписчика может быть список чатов
+    pairs = [(subscriber.name, chat, message) for subscriber in subscribers
+             for chat in chat_ids(subscriber.chat_id) for message in messages[subscriber.name]]
+    with metrics.stage('deliver', items_in=len(pairs)) as stage:
+        responses = get_sender(telegram_token).send_many([(chat, message) for _, chat, message in pairs],
+                                                         disable_web_page_preview=False)
+        stage.items_out = sum(bool(response.get('ok')) for response in responses)
+    results = {subscriber.name: {'ok': True, 'description': "Нет новостей по фильтрам подписчика"}
+               for subscriber in subscribers}
+    failed = set()
+    for (name, _, _), response in zip(pairs, responses):
+        if name not in failed:
+            results[name] = response
+            if not response.get('ok'):
+                failed.add(name)
+    return results
+
+
+def write_run_report(metrics: RunMetrics, base_directory: str, service_chat_id, telegram_token):
+    """Сохраняет отчёт о запуске (JSON-строка и, если настроено, Prometheus textfile) и шлёт сводку."""
+    metrics.extra['llm'] = usage.summary()
+    metrics.write_jsonl(os.path.join(base_directory, "run_metrics.jsonl"))
+    usage.write_jsonl(os.path.join(base_directory, "llm_usage.jsonl"), metrics.pipeline)
+    if load_config("metrics_textfile"):
+        metrics.write_prometheus(load_config("metrics_textfile"))
+    notify(metrics.summary() + "\n" + usage.summary_text(), service_chat_id, telegram_token)
+
+
+def job(infra: str = 'prod', run: Optional[str] = None):
+    """Дайджест окружения infra; run - слот расписания, у каждого слота свои контрольные точки."""
+    # Подписчики окружения; без ключа subscribers - TELEGRAM_CHAT_ID или TEST_TELEGRAM_CHAT_ID
+    subscribers = load_subscribers(infra)
+
+    service_chat_id = load_config("TEST_TELEGRAM_CHAT_ID")
+    telegram_token = load_config("TELEGRAM_BOT_TOKEN")
+    telegraph_access_token = load_config("TELEGRAPH_ACCESS_TOKEN")
+
+    base_directory = os.path.dirname(os.path.abspath(__file__))
+    today = datetime.datetime.now().date()
+    metrics = RunMetrics('digest', infra)
+    # Перезапуск в тот же день продолжает с первого незавершённого этапа
+    checkpoints = Checkpoints(os.path.join(base_directory, "checkpoints"), f"digest_{infra}", today, run=run)
+    if checkpoints.done('delivered'):
+        print("Дайджест за сегодня уже отправлен; для повторной отправки запустите с --fresh")
+        return
+
+    try:
+        # Получаем данные фидов
+        with metrics.stage('fetch') as stage:
+            items = checkpoints.get('items')
+            if items is None:
+                # Список лент в feed_urls, для старых конфигов - одна лента в feed_url, как в main.py
+                config = load_config()
+                feed_urls = parse_feed_urls(config.get("feed_urls") or config.get("feed_url") or DEFAULT_FEED_URLS)
+                stage.items_in = len(feed_urls)
+                feed_state = FeedState(os.path.join(base_directory, "feed_state.json"))
+                data, feed_errors = fetch_and_parse_rss_feed(feed_urls, today, feed_state)
+                for url, error in feed_errors.items():
+                    notify(f"Не удалось загрузить ленту {url}: {error}", service_chat_id, telegram_token)
+
+                # Преобразование и фильтрация данных
+                data = items_for_day(data, today)
+                checkpoints.put('items', data.to_dict('records'))
+            else:
+                import pandas as pd
+
+                data = pd.DataFrame(items, columns=['headline', 'link', 'description'])
+            stage.items_out = len(data)
+
+        with metrics.stage('classify', items_in=len(data)) as stage:
+            #data['category'] = generate_summary_batch(data['headline'].tolist(), tokenizer, model, batch_size=4)
+            categories = checkpoints.get('categories')
+            if categories is not None and len(categories) == len(data):
+                data['category'] = categories
+                usage.record_cache_hits('classify', len(categories), source='checkpoint')
+            else:
+                data['category'] = classify_headlines(data['headline'].tolist(), base_directory, metrics)
+                checkpoints.put('categories', data['category'].tolist())
+            stage.items_out = len(data)
+
+        with metrics.stage('dedup', items_in=len(data)) as stage:
+            from deduplication import deduplication
+            from story_index import StoryIndex
+
+            story_index = StoryIndex(os.path.join(base_directory, f"story_index_{infra}"), today=today)
+            result = deduplication(data, story_index=story_index)
+            stage.items_out = len(result)
+
+        # Повтор не присылает дайджест тем, кто уже получил его сегодня
+        delivered = checkpoints.get('delivered_to', {})
+        pending = [subscriber for subscriber in subscribers if subscriber.name not in delivered]
+        messages = prepare_messages(result, pending, telegraph_access_token, telegram_token, metrics)
+        responses = send_to_subscribers(messages, pending, telegram_token, metrics)
+        delivered.update({name: response for name, response in responses.items() if response.get('ok')})
+        checkpoints.put('delivered_to', delivered)
+        failed = sorted(name for name, response in responses.items() if not response.get('ok'))
+        if not failed:
+            notify("Сообщение успешно отправлено", service_chat_id, telegram_token)
+            # Запоминаем отправленные сюжеты, чтобы в следующие дни не присылать их как новые
+            story_index.add(data['headline'].tolist(), data['link'].tolist(), story_index.today)
+            story_index.save()
+            checkpoints.put('delivered', delivered)
+        else:
+            notify(f"Произошла ошибка при отправке: {', '.join(failed)}", service_chat_id, telegram_token)
+            raise RuntimeError(f"Дайджест не доставлен подписчикам: {', '.join(failed)}")
+        print(responses)
+        train_local_classifier(base_directory, metrics)
+    except Exception as e:
+        # Отчёт о запуске не должен называть успешным запуск, который завершился ошибкой
+        metrics.fail(e)
+        raise
+    finally:
+        write_run_report(metrics, base_directory, service_chat_id, telegram_token)
+        get_sender(telegram_token).flush()
+
+
+def main():
+    arguments = cli_arguments()
+    if arguments:
+        # Значение первого аргумента - окружение, prod или test
+        infra = arguments[0]
+        print(f"Переданное значение переменной: {infra}")
+    else:
+        infra = 'prod'
+        print("Аргумент не был передан.")
+    validate_config(REQUIRED_KEYS)
+    job(infra)
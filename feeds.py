@@ -0,0 +1,232 @@
+# coding: utf-8
+import datetime
+import json
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from email.utils import parsedate_to_datetime
+from typing import Optional
+from xml.etree import ElementTree as ET
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from files import atomic_write
+
+REQUEST_TIMEOUT = 30
+# Общее время на скачивание и разбор одной ленты
+FEED_DEADLINE = 60
+MAX_PARALLEL_FEEDS = 8
+# Сколько подряд идущих старых элементов допускаем, прежде чем прекратить разбор.
+# Ленты отсортированы от новых к старым, запас нужен на небольшой беспорядок в них
+STOP_AFTER_OLD_ITEMS = 10
+
+_session = None
+_session_lock = threading.Lock()
+
+MONTHS = {name: number for number, name in enumerate(
+    ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'], start=1)}
+
+
+def parse_pub_date(value: str) -> datetime.date:
+    """Дата из RFC-822 строки вида 'Tue, 10 Oct 2023 17:00:00 +0200'.
+
+    Как и strptime(..., '%z').date(), возвращает дату в часовом поясе ленты,
+    но без разбора времени и смещения. Нестандартные строки разбирает email.utils.
+    """
+    parts = value.split()
+    if parts and parts[0].endswith(','):
+        parts = parts[1:]
+    try:
+        return datetime.date(int(parts[2]), MONTHS[parts[1][:3].title()], int(parts[0]))
+    except (IndexError, KeyError, ValueError):
+        return parsedate_to_datetime(value).date()
+
+
+def iter_feed_items(source, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None,
+                    stop_after_old: int = STOP_AFTER_OLD_ITEMS):
+    """Потоково разбирает RSS и отдаёт элементы с pubDate в окне [start, end].
+
+    Разобранные элементы сразу удаляются из дерева, поэтому память не растёт
+    с размером ленты; после stop_after_old подряд идущих элементов старше start
+    разбор прекращается.
+    """
+    channel = None
+    old_in_row = 0
+    for event, elem in ET.iterparse(source, events=('start', 'end')):
+        if event == 'start':
+            if elem.tag == 'channel':
+                channel = elem
+            continue
+        if elem.tag != 'item':
+            continue
+
+        pub_date_text = elem.findtext('pubDate')
+        pub_date = parse_pub_date(pub_date_text) if pub_date_text else None
+        if start is not None and pub_date is not None and pub_date < start:
+            old_in_row += 1
+        else:
+            old_in_row = 0
+            if end is None or pub_date is None or pub_date <= end:
+                yield {
+                    'headline': elem.findtext('title'),
+                    'link': elem.findtext('link'),
+                    'pubDate': pub_date,
+                    'description': elem.findtext('description'),
+                }
+        # Освобождаем уже разобранные элементы
+        elem.clear()
+        if channel is not None:
+            channel.clear()
+        if stop_after_old and old_in_row >= stop_after_old:
+            break
+
+
+class FeedState:
+    """ETag/Last-Modified и последние разобранные элементы лент для условных запросов."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._state = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as file:
+                    self._state = json.load(file)
+            except (OSError, ValueError):
+                self._state = {}
+
+    def get(self, url: str) -> dict:
+        with self._lock:
+            return self._state.get(url, {})
+
+    def set(self, url: str, value: dict):
+        with self._lock:
+            self._state[url] = value
+            with atomic_write(self.path) as file:
+                json.dump(self._state, file, ensure_ascii=False, default=str)
+
+
+class _DeadlineReader:
+    """Обёртка над потоком ответа, которая прерывает медленную загрузку по дедлайну."""
+
+    def __init__(self, raw, deadline: float):
+        self.raw = raw
+        self.deadline = deadline
+
+    def read(self, size: int = -1) -> bytes:
+        if time.monotonic() > self.deadline:
+            raise TimeoutError("Превышено время загрузки ленты")
+        return self.raw.read(size)
+
+
+def make_session(pool_size: int = MAX_PARALLEL_FEEDS) -> requests.Session:
+    """Сессия с пулом соединений, общая для всех лент."""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    return session
+
+
+def get_session() -> requests.Session:
+    """Общая для процесса сессия: в scheduler.py соединения с лентами переживают запуск."""
+    global _session
+    with _session_lock:
+        if _session is None:
+            _session = make_session()
+        return _session
+
+
+def parse_feed_urls(value) -> list:
+    """Список лент из конфигурации: список или строка с адресами через запятую/пробел."""
+    if isinstance(value, str):
+        return [url for url in value.replace(',', ' ').split() if url]
+    return list(value)
+
+
+def fetch_feed_items(url: str, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None,
+                     state: Optional[FeedState] = None, session: Optional[requests.Session] = None,
+                     timeout: float = REQUEST_TIMEOUT, deadline: Optional[float] = None) -> list:
+    """Скачивает ленту и возвращает элементы из окна дат.
+
+    С переданным state отправляет If-None-Match/If-Modified-Since; если лента
+    не изменилась (304), возвращает элементы, разобранные в прошлый раз для того же окна.
+    deadline - момент по time.monotonic(), после которого загрузка прерывается.
+    """
+    http = session or requests
+    window = [start.isoformat() if start else None, end.isoformat() if end else None]
+    previous = state.get(url) if state is not None else {}
+    headers = {}
+    # Старые элементы годятся только для того же окна дат
+    if previous.get('window') == window:
+        if previous.get('etag'):
+            headers['If-None-Match'] = previous['etag']
+        if previous.get('last_modified'):
+            headers['If-Modified-Since'] = previous['last_modified']
+
+    with http.get(url, headers=headers, timeout=timeout, stream=True) as response:
+        if response.status_code == 304:
+            return [dict(item, pubDate=datetime.date.fromisoformat(item['pubDate']) if item['pubDate'] else None)
+                    for item in previous['items']]
+        response.raise_for_status()
+        response.raw.decode_content = True
+        source = response.raw if deadline is None else _DeadlineReader(response.raw, deadline)
+        items = list(iter_feed_items(source, start, end))
+
+    if state is not None:
+        state.set(url, {
+            'window': window,
+            'etag': response.headers.get('ETag'),
+            'last_modified': response.headers.get('Last-Modified'),
+            'items': [dict(item, pubDate=item['pubDate'].isoformat() if item['pubDate'] else None) for item in items],
+        })
+    return items
+
+
+def fetch_feeds(urls: list, start: Optional[datetime.date] = None, end: Optional[datetime.date] = None,
+                state: Optional[FeedState] = None, session: Optional[requests.Session] = None,
+                max_workers: int = MAX_PARALLEL_FEEDS, timeout: float = REQUEST_TIMEOUT,
+                feed_deadline: float = FEED_DEADLINE) -> tuple:
+    """Параллельно скачивает несколько лент и объединяет их элементы.
+
+    Ошибка или зависание одной ленты не мешает остальным: каждая лента
+    ограничена feed_deadline секундами, а её ошибка попадает во второй элемент
+    результата. Возвращает (элементы в порядке urls без повторов ссылок, {url: ошибка}).
+    Если не удалось загрузить ни одной ленты, выбрасывает ошибку первой из них.
+    Повторяющийся в urls адрес загружается один раз.
+    """
+    if not urls:
+        return [], {}
+    unique_urls = list(dict.fromkeys(urls))
+    if len(unique_urls) < len(urls):
+        # Результаты собираются по адресу: без явной проверки повтор молча схлопнулся бы
+        duplicates = sorted({url for url in urls if urls.count(url) > 1})
+        print(f"Ленты указаны несколько раз и загружаются один раз: {', '.join(duplicates)}")
+        urls = unique_urls
+    session = session or get_session()
+    deadline = time.monotonic() + feed_deadline
+    executor = ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(urls))))
+    futures = {url: executor.submit(fetch_feed_items, url, start, end, state, session, timeout, deadline)
+               for url in urls}
+    # Небольшой запас сверх дедлайна на завершение уже начатого чтения
+    wait(futures.values(), timeout=feed_deadline + timeout)
+    executor.shutdown(wait=False, cancel_futures=True)
+
+    items, errors, seen_links = [], {}, set()
+    for url, future in futures.items():
+        if not future.done():
+            errors[url] = TimeoutError("Превышено время загрузки ленты")
+            continue
+        if future.exception() is not None:
+            errors[url] = future.exception()
+            continue
+        for item in future.result():
+            if item['link'] in seen_links:
+                continue
+            seen_links.add(item['link'])
+            items.append(item)
+    if len(errors) == len(urls):
+        raise errors[urls[0]]
+    return items, errors
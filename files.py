@@ -0,0 +1,21 @@
+# coding: utf-8
+import contextlib
+import os
+
+
+@contextlib.contextmanager
+def atomic_write(path: str, mode: str = 'w'):
+    """Открывает временный файл рядом с path и после успешной записи заменяет им path.
+
+    Сбой посреди записи оставляет прежний файл нетронутым, так что читатели
+    (повторный запуск, node_exporter, соседние процессы) не видят недописанный.
+    """
+    tmp_path = path + '.tmp'
+    try:
+        with open(tmp_path, mode) as file:
+            yield file
+        os.replace(tmp_path, path)
+    except BaseException:
+        with contextlib.suppress(OSError):
+            os.remove(tmp_path)
+        raise
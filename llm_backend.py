@@ -0,0 +1,385 @@
+# coding: utf-8
+"""Общий интерфейс к LLM: OpenAI и Vertex AI Gemini за одним complete(prompt).
+
+- Каждый вызов - отдельный запрос без истории, поэтому размер промпта не
+  растёт от вызова к вызову и части сводки можно обобщать параллельно.
+- Клиенты общие на процесс: OpenAI - один клиент с пулом соединений
+  (get_client, им же пользуется classification.py), Gemini - одна
+  GenerativeModel на модель. Здесь же ошибки, после которых запрос
+  повторяется, и пауза перед повтором.
+- По каждому провайдеру ведётся скользящее окно задержек и ошибок. Запрос
+  уходит провайдеру с наименьшей ожидаемой задержкой с поправкой на долю
+  ошибок, при ошибке - следующему; провайдер без замеров пробуется первым.
+- С llm_hedge, если основной провайдер не ответил за свой p95, тот же запрос
+  дублируется следующему и берётся первый успешный ответ. Опоздавший ответ
+  тоже оплачивается и попадает в учёт llm_usage.
+
+Порядок провайдеров задаёт ключ llm_providers, модели - llm_models.
+"""
+import collections
+import os
+import random
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Optional
+
+from openai import OpenAI, APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+
+from config import config_flag, load_config, validate_config
+from llm_usage import BudgetExceeded, percentile, response_usage, usage
+from startup_profile import profiled
+
+SYSTEM_PROMPT = "Ты ассистент русскоязычного руководителя"
+DEFAULT_MODELS = {'openai': "gpt-4-0125-preview", 'gemini': "gemini-pro"}
+# Ключи конфигурации, без которых провайдер не работает
+PROVIDER_KEYS = {'openai': ("openai_token",), 'gemini': ("project_id", "region")}
+# Таймаут общего клиента OpenAI - хватает на категорию в classification.py
+CLIENT_TIMEOUT = 60.0
+# Ответ со сводкой генерируется дольше, чем категория
+REQUEST_TIMEOUT = 300.0
+MAX_RETRIES = 3
+BASE_DELAY = 1.0
+# Сколько последних вызовов провайдера учитывать и с какого числа замеров доверять p95
+STATS_WINDOW = 50
+HEDGE_MIN_SAMPLES = 5
+# Во сколько раз ошибки ухудшают оценку провайдера: при 10% ошибок - вдвое
+ERROR_PENALTY = 10.0
+# Ошибки старше этого не учитываются, и отказавший провайдер снова пробуется
+ERROR_TTL = 300.0
+MAX_PARALLEL_REQUESTS = 8
+
+# Ошибки OpenAI, после которых имеет смысл повторить запрос
+RETRYABLE_ERRORS = (RateLimitError, APITimeoutError, APIConnectionError, InternalServerError)
+
+_client = None
+_client_lock = threading.Lock()
+_routers = {}
+_routers_lock = threading.Lock()
+_gemini_models = {}
+_gemini_lock = threading.Lock()
+
+
+def get_client(api_key: str, timeout: float = CLIENT_TIMEOUT, base_url: Optional[str] = None) -> OpenAI:
+    """Возвращает общий для всех потоков клиент OpenAI с пулом соединений."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            # Повторы делаем сами, чтобы учитывать Retry-After и общий лимит запросов
+            with profiled("OpenAI client"):
+                _client = OpenAI(api_key=api_key, timeout=timeout, max_retries=0, base_url=base_url)
+    return _client
+
+
+def retry_delay(error: Exception, attempt: int, base_delay: float = BASE_DELAY) -> float:
+    """Пауза перед повтором: Retry-After из ответа 429, иначе экспоненциальная с джиттером."""
+    response = getattr(error, 'response', None)
+    headers = getattr(response, 'headers', None)
+    if headers is not None:
+        retry_after = headers.get('retry-after')
+        if retry_after:
+            try:
+                return max(float(retry_after), 0.0)
+            except ValueError:
+                pass
+    return base_delay * 2 ** attempt + random.uniform(0, base_delay)
+
+
+class OpenAIProvider:
+    name = 'openai'
+
+    def __init__(self, model: str):
+        self.model = model
+
+    @property
+    def client(self):
+        # Копия с другим таймаутом делит пул соединений с общим клиентом
+        return get_client(load_config("openai_token"), base_url=load_config("openai_base_url")).with_options(
+            timeout=REQUEST_TIMEOUT)
+
+    def warm(self):
+        self.client
+
+    def retryable(self, error: Exception) -> bool:
+        return isinstance(error, RETRYABLE_ERRORS)
+
+    def _messages(self, prompt: str) -> list:
+        return [{"role": "system", "content": SYSTEM_PROMPT}, {"role": "user", "content": prompt}]
+
+    def complete(self, prompt: str, stage: str) -> str:
+        # После части бюджета - дешёвая модель, после всего бюджета - BudgetExceeded
+        model = usage.model_for(self.model)
+        with usage.call(stage, model) as call:
+            response = self.client.chat.completions.create(model=model, messages=self._messages(prompt))
+            call.usage(*response_usage(response))
+        if isinstance(response, dict):
+            return response['choices'][0]['message']['content']
+        return response.choices[0].message.content
+
+    def stream(self, prompt: str, stage: str):
+        from summarization import count_tokens
+
+        model = usage.model_for(self.model)
+        with usage.call(stage, model) as call:
+            stream = self.client.chat.completions.create(model=model, messages=self._messages(prompt), stream=True,
+                                                         stream_options={"include_usage": True})
+            parts = []
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    parts.append(chunk.choices[0].delta.content)
+                    yield parts[-1]
+                if getattr(chunk, 'usage', None):
+                    call.usage(*response_usage(chunk))
+            if not call.prompt_tokens:
+                # Сервер не прислал usage - оцениваем по тексту
+                call.usage(count_tokens(prompt), count_tokens("".join(parts)), estimated=True)
+
+
+class GeminiProvider:
+    name = 'gemini'
+
+    def __init__(self, model: str):
+        self.model = model
+
+    @property
+    def client(self):
+        with _gemini_lock:
+            generative_model = _gemini_models.get(self.model)
+            if generative_model is None:
+                with profiled("Vertex AI init"):
+                    import vertexai
+                    from google.oauth2 import service_account
+                    from vertexai.preview.generative_models import GenerativeModel
+
+                    if not _gemini_models:
+                        credentials = service_account.Credentials.from_service_account_file(
+                            os.path.join(os.getcwd(), 'secret.json'),
+                            scopes=['https://www.googleapis.com/auth/cloud-platform'])
+                        vertexai.init(project=load_config('project_id'), location=load_config('region'),
+                                      credentials=credentials)
+                    generative_model = _gemini_models[self.model] = GenerativeModel(self.model)
+            return generative_model
+
+    def warm(self):
+        self.client
+
+    def retryable(self, error: Exception) -> bool:
+        try:
+            from google.api_core import exceptions
+        except ImportError:
+            return isinstance(error, (ConnectionError, TimeoutError))
+        return isinstance(error, (exceptions.TooManyRequests, exceptions.ServiceUnavailable,
+                                  exceptions.InternalServerError, exceptions.DeadlineExceeded,
+                                  ConnectionError, TimeoutError))
+
+    def _check_budget(self):
+        # Более дешёвой модели Gemini не задано, поэтому бюджет только переводит в упрощённый режим
+        if usage.degraded:
+            raise BudgetExceeded("Бюджет на LLM исчерпан")
+
+    def complete(self, prompt: str, stage: str) -> str:
+        self._check_budget()
+        with usage.call(stage, self.model) as call:
+            response = self.client.generate_content(prompt)
+            call.usage(*response_usage(response))
+        return response.text
+
+    def stream(self, prompt: str, stage: str):
+        from summarization import count_tokens
+
+        self._check_budget()
+        with usage.call(stage, self.model) as call:
+            parts = []
+            for chunk in self.client.generate_content(prompt, stream=True):
+                parts.append(chunk.text)
+                yield chunk.text
+            call.usage(count_tokens(prompt), count_tokens("".join(parts)), estimated=True)
+
+
+PROVIDERS = {'openai': OpenAIProvider, 'gemini': GeminiProvider}
+
+
+class ProviderStats:
+    """Задержки успешных вызовов и исходы последних вызовов одного провайдера."""
+
+    def __init__(self, window: int = STATS_WINDOW):
+        self.latencies = collections.deque(maxlen=window)
+        self.outcomes = collections.deque(maxlen=window)
+        self.hedged = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float, ok: bool):
+        with self._lock:
+            self.outcomes.append((time.monotonic(), ok))
+            if ok:
+                self.latencies.append(seconds)
+
+    def _recent(self) -> list:
+        oldest = time.monotonic() - ERROR_TTL
+        with self._lock:
+            return [ok for moment, ok in self.outcomes if moment >= oldest]
+
+    @property
+    def calls(self) -> int:
+        return len(self.outcomes)
+
+    def _percentile(self, share: float) -> Optional[float]:
+        with self._lock:
+            return percentile(sorted(self.latencies), share)
+
+    @property
+    def p50(self) -> Optional[float]:
+        return self._percentile(0.5)
+
+    @property
+    def p95(self) -> Optional[float]:
+        return self._percentile(0.95)
+
+    @property
+    def error_rate(self) -> float:
+        recent = self._recent()
+        return (len(recent) - sum(recent)) / len(recent) if recent else 0.0
+
+    def score(self) -> float:
+        """Ожидаемая задержка с поправкой на недавние ошибки; без замеров - 0, чтобы провайдера попробовали."""
+        recent = self._recent()
+        if not recent:
+            return 0.0 if not self.latencies else self.p50
+        if not self.latencies:
+            return float('inf')
+        return self.p50 * (1 + ERROR_PENALTY * self.error_rate)
+
+    def hedge_after(self) -> Optional[float]:
+        """Через сколько секунд дублировать запрос: p95, когда замеров достаточно."""
+        with self._lock:
+            enough = len(self.latencies) >= HEDGE_MIN_SAMPLES
+        return self.p95 if enough else None
+
+
+class LLMRouter:
+    def __init__(self, providers: list, hedge: bool = False, max_retries: int = MAX_RETRIES):
+        self.providers = providers
+        self.hedge = hedge
+        self.max_retries = max_retries
+        self.stats = {provider.name: ProviderStats() for provider in providers}
+        self._executor = ThreadPoolExecutor(max_workers=MAX_PARALLEL_REQUESTS)
+
+    def warm(self):
+        """Создаёт клиенты заранее, чтобы первый запрос не платил за инициализацию."""
+        for provider in self.providers:
+            provider.warm()
+
+    def ranked(self) -> list:
+        order = {provider.name: index for index, provider in enumerate(self.providers)}
+        return sorted(self.providers, key=lambda provider: (self.stats[provider.name].score(), order[provider.name]))
+
+    def _call(self, provider, prompt: str, stage: str) -> str:
+        started = time.perf_counter()
+        try:
+            text = provider.complete(prompt, stage)
+        except BudgetExceeded:
+            raise
+        except Exception:
+            self.stats[provider.name].record(time.perf_counter() - started, False)
+            raise
+        self.stats[provider.name].record(time.perf_counter() - started, True)
+        return text
+
+    def _complete_once(self, prompt: str, stage: str) -> str:
+        """Один проход по провайдерам: переход к следующему при ошибке и дубль после p95."""
+        queue = self.ranked()
+        pending = {}
+        errors = []
+
+        def launch():
+            provider = queue.pop(0)
+            pending[self._executor.submit(self._call, provider, prompt, stage)] = provider
+
+        launch()
+        while pending:
+            timeout = None
+            if self.hedge and queue and len(pending) == 1:
+                timeout = self.stats[next(iter(pending.values())).name].hedge_after()
+            done, _ = wait(pending, timeout=timeout, return_when=FIRST_COMPLETED)
+            if not done:
+                # Основной провайдер не уложился в свой p95 - тот же запрос уходит следующему
+                self.stats[next(iter(pending.values())).name].hedged += 1
+                launch()
+                continue
+            for future in done:
+                pending.pop(future)
+                try:
+                    return future.result()
+                except BudgetExceeded:
+                    raise
+                except Exception as e:
+                    errors.append(e)
+            if not pending and queue:
+                launch()
+        raise errors[-1]
+
+    def complete(self, prompt: str, stage: str = 'summary') -> str:
+        for attempt in range(self.max_retries + 1):
+            try:
+                return self._complete_once(prompt, stage)
+            except BudgetExceeded:
+                raise
+            except Exception as e:
+                # Повторяем весь проход, только если последняя ошибка временная
+                if attempt == self.max_retries or not any(provider.retryable(e) for provider in self.providers):
+                    raise
+                time.sleep(retry_delay(e, attempt))
+
+    def stream(self, prompt: str, stage: str = 'summary'):
+        """Поток от лучшего провайдера; на другого переходим, только если ещё ничего не показано."""
+        errors = []
+        for provider in self.ranked():
+            started = time.perf_counter()
+            shown = False
+            try:
+                for delta in provider.stream(prompt, stage):
+                    shown = True
+                    yield delta
+            except BudgetExceeded:
+                raise
+            except Exception as e:
+                self.stats[provider.name].record(time.perf_counter() - started, False)
+                if shown:
+                    raise
+                errors.append(e)
+                continue
+            self.stats[provider.name].record(time.perf_counter() - started, True)
+            return
+        raise errors[-1]
+
+    def summary_text(self) -> str:
+        """Короткая сводка по провайдерам для служебного чата."""
+        lines = []
+        for provider in self.providers:
+            stats = self.stats[provider.name]
+            p95 = "-" if stats.p95 is None else f"{stats.p95:.1f} с"
+            lines.append(f"{provider.name} ({provider.model}): {stats.calls} вызовов, "
+                         f"ошибок {stats.error_rate:.0%}, p95 {p95}, дублей {stats.hedged}")
+        return "\n".join(lines)
+
+
+def provider_names(value) -> list:
+    if isinstance(value, str):
+        return [name for name in value.replace(',', ' ').split() if name]
+    return list(value)
+
+
+def get_router(default_providers: tuple = ('openai',)) -> LLMRouter:
+    """Общий для процесса маршрутизатор: провайдеры из llm_providers или default_providers."""
+    names = tuple(provider_names(load_config("llm_providers") or default_providers))
+    with _routers_lock:
+        router = _routers.get(names)
+        if router is None:
+            unknown = [name for name in names if name not in PROVIDERS]
+            if unknown or not names:
+                raise ValueError(f"Неизвестные провайдеры LLM: {', '.join(unknown) or '(пусто)'}")
+            validate_config(tuple(key for name in names for key in PROVIDER_KEYS[name]))
+            models = dict(DEFAULT_MODELS, **load_config("llm_models"))
+            router = _routers[names] = LLMRouter([PROVIDERS[name](models[name]) for name in names],
+                                                 hedge=config_flag("llm_hedge"))
+        return router
@@ -0,0 +1,200 @@
+# coding: utf-8
+"""Учёт токенов, задержки и стоимости запросов к LLM и бюджеты на запуск.
+
+Каждый вызов модели записывается с этапом (classify, summary, ...), моделью,
+числом токенов запроса и ответа, временем и оценкой стоимости. Ответы из кэша
+и локального классификатора учитываются на том же этапе как попадания, чтобы
+было видно, сколько запросов они сэкономили.
+
+Бюджеты задаются в конфигурации:
+- llm_budget_usd - предел стоимости за запуск; после него модель больше не
+  вызывается (BudgetExceeded), и конвейер переходит в упрощённый режим;
+- llm_downgrade_share - доля бюджета, после которой запросы идут в более
+  дешёвую llm_fallback_model.
+"""
+import collections
+import contextlib
+import datetime
+import json
+import threading
+import time
+from typing import Optional
+
+from config import load_config
+
+# Цена за миллион токенов (запрос, ответ) в долларах; переопределяется ключом llm_prices
+PRICES = {
+    "gpt-4-0125-preview": (10.0, 30.0),
+    "gpt-4-turbo": (10.0, 30.0),
+    "gpt-4o": (5.0, 15.0),
+    "gpt-4o-mini": (0.15, 0.6),
+    "gpt-3.5-turbo-0125": (0.5, 1.5),
+    "gemini-pro": (0.5, 1.5),
+}
+
+
+class BudgetExceeded(Exception):
+    pass
+
+
+class UsageTracker:
+    def __init__(self):
+        self.records = []
+        self.cache_hits = collections.Counter()
+        self._lock = threading.Lock()
+
+    def reset(self):
+        """Начинает учёт заново - перед каждым запуском в долгоживущем процессе (scheduler.py)."""
+        with self._lock:
+            self.records = []
+            self.cache_hits = collections.Counter()
+
+    def _setting(self, key: str, default=None):
+        try:
+            value = load_config(key)
+        except KeyError:
+            return default
+        return default if value is None else value
+
+    def price(self, model: str) -> tuple:
+        prices = dict(PRICES, **{name: tuple(value) for name, value in self._setting("llm_prices", {}).items()})
+        return prices.get(model, (0.0, 0.0))
+
+    def record(self, stage: str, model: str, prompt_tokens: int, completion_tokens: int, seconds: float,
+               error: Optional[str] = None, estimated: bool = False) -> dict:
+        prompt_price, completion_price = self.price(model)
+        entry = {
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'stage': stage,
+            'model': model,
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'seconds': round(seconds, 3),
+            'cost_usd': (prompt_tokens * prompt_price + completion_tokens * completion_price) / 1e6,
+            # Токены посчитаны по тексту, а не взяты из ответа API (потоковый режим)
+            'estimated': estimated,
+            'error': error,
+        }
+        with self._lock:
+            self.records.append(entry)
+        return entry
+
+    def record_cache_hits(self, stage: str, count: int, source: str = 'cache'):
+        """Ответы, не потребовавшие запроса к LLM: source - 'cache', 'local' или 'checkpoint'."""
+        if count:
+            with self._lock:
+                self.cache_hits[(stage, source)] += count
+
+    @contextlib.contextmanager
+    def call(self, stage: str, model: str):
+        """Замеряет один вызов модели; токены выставляются через call.usage(prompt, completion)."""
+        call = _Call()
+        started = time.perf_counter()
+        try:
+            yield call
+        except Exception as e:
+            self.record(stage, model, call.prompt_tokens, call.completion_tokens, time.perf_counter() - started,
+                        error=repr(e))
+            raise
+        self.record(stage, model, call.prompt_tokens, call.completion_tokens, time.perf_counter() - started,
+                    estimated=call.estimated)
+
+    @property
+    def cost(self) -> float:
+        with self._lock:
+            return sum(entry['cost_usd'] for entry in self.records)
+
+    def model_for(self, model: str) -> str:
+        """Модель для следующего запроса: основная или дешёвая, если потрачена заданная доля бюджета."""
+        budget = self._setting("llm_budget_usd")
+        if budget is None:
+            return model
+        if self.cost >= float(budget):
+            raise BudgetExceeded(f"Бюджет на LLM исчерпан: ${self.cost:.4f} из ${float(budget):.4f}")
+        fallback = self._setting("llm_fallback_model")
+        if fallback and self.cost >= float(budget) * float(self._setting("llm_downgrade_share", 0.5)):
+            return fallback
+        return model
+
+    @property
+    def degraded(self) -> bool:
+        budget = self._setting("llm_budget_usd")
+        return budget is not None and self.cost >= float(budget)
+
+    def summary(self) -> dict:
+        """Итоги по этапам: вызовы, токены, стоимость, p50/p95 задержки и ответы без LLM по источникам."""
+        with self._lock:
+            records = list(self.records)
+            cache_hits = dict(self.cache_hits)
+        stages = {}
+        for stage in sorted({entry['stage'] for entry in records} | {stage for stage, _ in cache_hits}):
+            entries = [entry for entry in records if entry['stage'] == stage]
+            latencies = sorted(entry['seconds'] for entry in entries)
+            stages[stage] = {
+                'calls': len(entries),
+                'errors': sum(entry['error'] is not None for entry in entries),
+                'prompt_tokens': sum(entry['prompt_tokens'] for entry in entries),
+                'completion_tokens': sum(entry['completion_tokens'] for entry in entries),
+                'cost_usd': round(sum(entry['cost_usd'] for entry in entries), 6),
+                'p50_seconds': percentile(latencies, 0.5),
+                'p95_seconds': percentile(latencies, 0.95),
+                'hits': {source: count for (hit_stage, source), count in cache_hits.items() if hit_stage == stage},
+                'models': sorted({entry['model'] for entry in entries}),
+            }
+        return {'cost_usd': round(sum(entry['cost_usd'] for entry in records), 6),
+                'degraded': self.degraded, 'stages': stages}
+
+    def summary_text(self) -> str:
+        """Короткая сводка для служебного чата."""
+        summary = self.summary()
+        lines = [f"LLM: ${summary['cost_usd']:.4f}" + (" (бюджет исчерпан)" if summary['degraded'] else "")]
+        for stage, totals in summary['stages'].items():
+            hits = ", ".join(f"{source}: {count}" for source, count in totals['hits'].items())
+            p95 = "-" if totals['p95_seconds'] is None else f"{totals['p95_seconds']:.1f} с"
+            lines.append(f"{stage}: {totals['calls']} вызовов, {totals['prompt_tokens']}+{totals['completion_tokens']} "
+                         f"токенов, ${totals['cost_usd']:.4f}, p95 {p95}" + (f", без LLM - {hits}" if hits else ""))
+        return "\n".join(lines)
+
+    def write_jsonl(self, path: str, pipeline: str):
+        """Дописывает все вызовы запуска, по строке на вызов."""
+        with self._lock:
+            records = list(self.records)
+        with open(path, 'a') as file:
+            for entry in records:
+                file.write(json.dumps(dict(entry, pipeline=pipeline), ensure_ascii=False) + "\n")
+
+
+class _Call:
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.estimated = False
+
+    def usage(self, prompt_tokens: Optional[int], completion_tokens: Optional[int], estimated: bool = False):
+        self.prompt_tokens = prompt_tokens or 0
+        self.completion_tokens = completion_tokens or 0
+        self.estimated = estimated
+
+
+def percentile(values: list, share: float) -> Optional[float]:
+    if not values:
+        return None
+    return values[min(len(values) - 1, int(share * len(values)))]
+
+
+def response_usage(response) -> tuple:
+    """(prompt_tokens, completion_tokens) из ответа OpenAI (объект или словарь) или Gemini."""
+    if isinstance(response, dict):
+        usage = response.get('usage') or {}
+        return usage.get('prompt_tokens'), usage.get('completion_tokens')
+    usage = getattr(response, 'usage', None)
+    if usage is not None:
+        return usage.prompt_tokens, usage.completion_tokens
+    metadata = getattr(response, 'usage_metadata', None)
+    if metadata is not None:
+        return metadata.prompt_token_count, metadata.candidates_token_count
+    return None, None
+
+
+# Общий учёт на процесс: вызовы идут из разных модулей и потоков
+usage = UsageTracker()
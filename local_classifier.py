@@ -0,0 +1,84 @@
+# coding: utf-8
+import os
+import pickle
+
+from files import atomic_write
+
+# Ответ локальной модели принимается только при такой уверенности
+LOCAL_MIN_CONFIDENCE = 0.8
+# Меньше этого числа размеченных заголовков модель не обучаем
+LOCAL_MIN_SAMPLES = 200
+
+
+class LocalClassifier:
+    """TF-IDF + логистическая регрессия, обученные на ответах LLM из кэша классификации.
+
+    Отвечает за миллисекунды; неуверенные заголовки остаются для LLM.
+    """
+
+    def __init__(self, min_confidence: float = LOCAL_MIN_CONFIDENCE):
+        self.min_confidence = min_confidence
+        self.pipeline = None
+        self.answered = 0
+        self.deferred = 0
+
+    @property
+    def trained(self) -> bool:
+        return self.pipeline is not None
+
+    def fit(self, pairs: list, min_samples: int = LOCAL_MIN_SAMPLES) -> bool:
+        """Обучает модель на парах (заголовок, категория). Возвращает False, если данных мало."""
+        if len(pairs) < min_samples:
+            return False
+        headlines = [headline for headline, _ in pairs]
+        categories = [category for _, category in pairs]
+        if len(set(categories)) < 2:
+            return False
+        from sklearn.feature_extraction.text import TfidfVectorizer
+        from sklearn.linear_model import LogisticRegression
+        from sklearn.pipeline import make_pipeline
+
+        # Символьные n-граммы устойчивы к падежам и смеси кириллицы с латиницей
+        pipeline = make_pipeline(
+            TfidfVectorizer(analyzer='char_wb', ngram_range=(2, 4), sublinear_tf=True, min_df=2),
+            LogisticRegression(max_iter=1000),
+        )
+        pipeline.fit(headlines, categories)
+        self.pipeline = pipeline
+        return True
+
+    def predict(self, headlines: list) -> tuple:
+        """Возвращает (категории, уверенность) для каждого заголовка."""
+        if not self.trained or not headlines:
+            return [None] * len(headlines), [0.0] * len(headlines)
+        probabilities = self.pipeline.predict_proba(headlines)
+        best = probabilities.argmax(axis=1)
+        classes = self.pipeline.classes_
+        return [classes[i] for i in best], [float(row[i]) for row, i in zip(probabilities, best)]
+
+    def classify(self, headlines: list) -> list:
+        """Категории для уверенно распознанных заголовков, None для остальных."""
+        categories, confidences = self.predict(headlines)
+        result = [category if confidence >= self.min_confidence else None
+                  for category, confidence in zip(categories, confidences)]
+        answered = sum(category is not None for category in result)
+        self.answered += answered
+        self.deferred += len(result) - answered
+        return result
+
+    def save(self, path: str):
+        # Сбой посреди записи не должен оставить битую модель
+        with atomic_write(path, 'wb') as file:
+            pickle.dump(self.pipeline, file)
+
+    @classmethod
+    def load(cls, path: str, min_confidence: float = LOCAL_MIN_CONFIDENCE) -> 'LocalClassifier':
+        classifier = cls(min_confidence)
+        if os.path.exists(path):
+            try:
+                with open(path, 'rb') as file:
+                    classifier.pipeline = pickle.load(file)
+            except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError):
+                # Модель от несовместимой версии sklearn просто переобучится
+                classifier.pipeline = None
+        return classifier
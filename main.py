@@ -1,74 +1,77 @@
-from xml.etree import ElementTree as ET
-import datetime
-import requests
-from openai import OpenAI
+import startup_profile
+
+startup_profile.install_if_requested()
 
+import datetime
 import os
-import json
 import time
-from typing import Optional
-from bs4 import BeautifulSoup
 
+from checkpoints import Checkpoints
+from config import config_flag, load_config, validate_config
+from feeds import FeedState, fetch_feeds, parse_feed_urls
+from startup_profile import profiled
+from llm_backend import get_router
+from llm_usage import BudgetExceeded, usage
+from summarization import SUMMARY_PROMPT, add_missing, fits_single_request, format_titles, summarize
+from telegram_delivery import StreamingMessage, get_sender
+from telegram_html import split_html
 
-def load_config(key: Optional[str] = None):
-    # Получение абсолютного пути к директории, где находится main.py
-    current_directory = os.path.dirname(os.path.abspath(__file__))
-    # Объединение этого пути с именем файла, который вы хотите открыть
-    file_path = os.path.join(current_directory, "config.json")
+# Получение абсолютного пути к директории, где находится main.py
+current_directory = os.path.dirname(os.path.abspath(__file__))
 
-    with open(file_path, "r") as file:
-        config = json.load(file)
+# Ключи, без которых скрипт не запустится
+REQUIRED_KEYS = ("openai_token", "TELEGRAM_BOT_TOKEN", "TELEGRAM_CHAT_ID", "TEST_TELEGRAM_CHAT_ID")
+validate_config(REQUIRED_KEYS)
 
-    if key:
-        if key not in config:
-            raise KeyError(f"The key '{key}' was not found in the config file.")
-        return config[key]  # Возвращаем значение заданного ключа
-    else:
-        return config  # Возвращаем весь конфигурационный словарь
 
+# Провайдеры из llm_providers, по умолчанию OpenAI; клиенты создаются сразу, чтобы их
+# инициализация не попадала в первый запрос
+with profiled("LLM clients"):
+    router = get_router(('openai',))
+    router.warm()
 
-# Здесь должен быть ваш OpenAI API ключ
-client = OpenAI(api_key=load_config("openai_token"))
 
-
-def fetch_news_titles(url):
-    response = requests.get(url)
-    root = ET.fromstring(response.content)
+def fetch_news_titles(urls):
     today = datetime.datetime.now().date()
     yesterday = today - datetime.timedelta(days=1)
-    titles_today = []
-
-    for item in root.findall('.//item'):
-        pub_date = item.find('pubDate').text
-        pub_date = datetime.datetime.strptime(pub_date, '%a, %d %b %Y %H:%M:%S %z').date()
-        if pub_date == today:
-            title = item.find('title').text
-            link = item.find('link').text
-            titles_today.append((title, link))
-
-    titles_text = ' ;'.join([f"Заголовок: {title}, Ссылка: {link}" for title, link in titles_today])
-    return titles_text
-
-
-def process_titles_with_gpt(titles_text):
-    prompt_text = (
-            "Создайте сводку дня, обобщив следующие заголовки новостей на русском языке. Выделите номер каждой новости жирным шрифтом с помощью тега <b>. Для заголовков новостей используйте курсив с помощью тега <i>. Все ссылки на статьи должны быть представлены в виде гиперссылок, преобразованных в кнопки, с добавлением к URL 'https://dzarlax.dev/rss/articles/article.html?link=' и использованием тега <a href>, где название источника новости будет отображаться как название кнопки. Группируйте ссылки вместе с соответствующими заголовками по тематическому принципу. Разделите разные новости тегом переноса строки <br>. Обработайте все предоставленные новости без сокращений. Вот список заголовков и соответствующих ссылок: " + titles_text
-    )
-    response = client.chat.completions.create(  # Используйте 'completions.create' для получения ответа
-        model="gpt-4-0125-preview",
-        messages=[
-            {"role": "system", "content": "Ты ассистент русскоязычного руководителя"},
-            {"role": "user", "content": prompt_text},
-        ]
-    )
-
-    # Проверьте, является ли 'response' словарём или объектом
-    # Если 'response' - это словарь (как показано в вашем примере ошибки), используйте код ниже:
-    if isinstance(response, dict):
-        summary = response['choices'][0]['message']['content']
-    # Если 'response' - это объект, попробуйте использовать точечную нотацию:
-    else:
-        summary = response.choices[0].message.content
+    state = FeedState(os.path.join(current_directory, "feed_state.json"))
+    items, errors = fetch_feeds(urls, start=today, end=today, state=state)
+    for url, error in errors.items():
+        send_error(f"Не удалось загрузить ленту {url}: {error}")
+    # Пары (заголовок, ссылка); в промпт их собирает summarization.format_titles
+    return [(item['headline'], item['link']) for item in items]
+
+
+def complete_stream(prompt_text):
+    return router.stream(prompt_text)
+
+
+def stream_titles_to_telegram(titles):
+    # Первое сообщение уходит с первыми токенами, дальше оно дополняется через editMessageText
+    message = StreamingMessage(get_sender(load_config("TELEGRAM_BOT_TOKEN")), load_config("TELEGRAM_CHAT_ID"),
+                               disable_web_page_preview="true")
+    try:
+        for delta in complete_stream(SUMMARY_PROMPT + format_titles(titles)):
+            message.feed(delta)
+        summary = add_missing(message.raw, titles)
+        response = message.finish(summary)
+    except Exception:
+        # Недописанная сводка не должна остаться в чате рядом с повторной отправкой
+        message.discard()
+        raise
+    if not response.get('ok'):
+        message.discard()
+    return summary, response
+
+
+def process_titles_with_gpt(titles):
+    # Большой день делится на части по токенам, части обобщаются параллельно и сливаются
+    try:
+        summary = summarize(titles, router.complete)
+    except BudgetExceeded as e:
+        # Упрощённый режим: список заголовков со ссылками без обращения к LLM
+        send_error(f"{e}, сводка собрана без LLM")
+        summary = add_missing("", titles)
     print(summary)
     return summary
 
@@ -76,72 +79,60 @@ def process_titles_with_gpt(titles_text):
 def send_error(message):
     telegram_token = load_config("TELEGRAM_BOT_TOKEN")
     telegram_chat_id = load_config("TEST_TELEGRAM_CHAT_ID")
-    send_message_url = f"https://api.telegram.org/bot{telegram_token}/sendMessage"
-    data = {
-        "chat_id": telegram_chat_id,
-        "text": message
-    }
-    response = requests.post(send_message_url, data=data)
+    get_sender(telegram_token).send(telegram_chat_id, str(message), parse_mode=None)
 
 
-def send_telegram_message(message):
+def send_telegram_message(messages):
     telegram_token = load_config("TELEGRAM_BOT_TOKEN")
     telegram_chat_id = load_config("TELEGRAM_CHAT_ID")
     #telegram_chat_id = load_config("TEST_TELEGRAM_CHAT_ID")
-    send_message_url = f"https://api.telegram.org/bot{telegram_token}/sendMessage"
-
-    data = {
-        "parse_mode": "HTML",
-        "disable_web_page_preview": "true",
-        "chat_id": telegram_chat_id,
-        "text": message,
-    }
 
-    try:
-        response = requests.post(send_message_url, data=data)
-        response.raise_for_status()  # Вызовет исключение для статусов HTTP, отличных от 200
-
-        # Возвращает JSON ответа, который должен содержать 'ok': True, если сообщение было успешно отправлено
-        return response.json()
-    except requests.RequestException as e:
-        send_error(f"Произошла ошибка при отправке сообщения: {e}")
-
-        # Возвращаем словарь с 'ok': False в случае неудачи, чтобы отражать результат
-        return {"ok": False, "error": str(e)}
-
-
-def clean_html(html):
-    # Разбираем HTML
-    soup = BeautifulSoup(html, 'html.parser')
-
-    # Разрешенные теги
-    allowed_tags = ['b', 'i', 'a', 'code']
-
-    # Удаляем все теги, кроме разрешенных
-    for tag in soup.find_all():
-        if tag.name not in allowed_tags:
-            tag.unwrap()
-
-    # Возвращаем "очищенный" HTML
-    return str(soup)
-
-
-def job():
-    url = load_config("feed_url")
+    # Отправитель сам выдерживает лимиты Telegram и повторяет временные сбои;
+    # части длинной сводки уходят в чат по порядку
+    responses = get_sender(telegram_token).send_many([(telegram_chat_id, message) for message in messages],
+                                                     disable_web_page_preview="true")
+    # Первая неудачная часть или ответ на последнюю
+    response = next((r for r in responses if not r.get('ok')), responses[-1] if responses else
+                    {'ok': False, 'description': 'empty text'})
+    if not response.get('ok'):
+        send_error(f"Произошла ошибка при отправке сообщения: {response.get('description')}")
+    return response
+
+
+def job(run=None):
+    """Собирает и отправляет сводку; run - слот расписания, у каждого слота свои контрольные точки."""
+    config = load_config()
+    # Список лент в feed_urls, для старых конфигов - одна лента в feed_url
+    urls = parse_feed_urls(config.get("feed_urls") or config["feed_url"])
+    # Повтор и перезапуск в тот же день продолжают с первого незавершённого этапа
+    checkpoints = Checkpoints(os.path.join(current_directory, "checkpoints"), "main", run=run)
+    if checkpoints.done('delivered'):
+        send_error("Сводка за сегодня уже отправлена; для повторной отправки запустите с --fresh")
+        return
     max_retries = 3  # Максимальное количество попыток
     retries = 0
+    delivered = False
 
     while retries < max_retries:
         try:
             # Загрузка и обработка заголовков новостей
-            today_titles = fetch_news_titles(url)
-            summary = process_titles_with_gpt(today_titles)
-            cleaned_html = clean_html(summary)
+            today_titles = checkpoints.stage('items', lambda: fetch_news_titles(urls))
+            # Потоковый показ - только с первой попытки и для дня, умещающегося в один запрос
+            if (config_flag("stream_summary") and retries == 0 and not checkpoints.done('summary')
+                    and fits_single_request(today_titles)):
+                summary, response = stream_titles_to_telegram(today_titles)
+                checkpoints.put('summary', summary)
+            else:
+                summary = checkpoints.stage('summary', lambda: process_titles_with_gpt(today_titles))
+                # Очищенная сводка, поделённая на сообщения Telegram
+                messages = checkpoints.stage('messages', lambda: split_html(summary))
 
-            # Попытка отправки сообщения
-            response = send_telegram_message(cleaned_html)
+                # Попытка отправки сообщения
+                response = send_telegram_message(messages)
             # Проверка успешности отправки
             if response.get('ok'):
+                checkpoints.put('delivered', response)
+                delivered = True
                 send_error("Сообщение успешно отправлено")
                 break  # Выход из цикла, если отправка успешна
             else:
@@ -156,5 +147,13 @@ def job():
                 send_error("Превышено максимальное количество попыток отправки")
                 break
 
+    usage.write_jsonl(os.path.join(current_directory, "llm_usage.jsonl"), "main")
+    send_error(usage.summary_text() + "\n" + router.summary_text())
+    if not delivered:
+        # Ошибка видна вызывающему: cron получает ненулевой код, scheduler.py - статус error
+        raise RuntimeError("Сводка не доставлена")
+
 
-job()
+# При импорте из scheduler.py job() запускается по расписанию
+if __name__ == "__main__":
+    job()
@@ -1,128 +1,124 @@
-from xml.etree import ElementTree as ET
-import datetime
-import requests
-import vertexai
-from vertexai.preview.generative_models import GenerativeModel, ChatSession
-import os
-import json
-from typing import Optional
-from bs4 import BeautifulSoup
-from google.oauth2 import service_account
+import startup_profile
 
-current_directory = os.path.dirname(os.path.abspath(__file__))
+startup_profile.install_if_requested()
 
-def load_config(key: Optional[str] = None):
-    # Получение абсолютного пути к директории, где находится main.py
-    # Объединение этого пути с именем файла, который вы хотите открыть
-    file_path = os.path.join(current_directory, "config.json")
+import datetime
+import os
 
-    with open(file_path, "r") as file:
-        config = json.load(file)
+from checkpoints import Checkpoints
+from config import config_flag, load_config, validate_config
+from feeds import FeedState, fetch_feeds, parse_feed_urls
+from startup_profile import profiled
+from llm_backend import get_router
+from llm_usage import BudgetExceeded, usage
+from summarization import SUMMARY_PROMPT, add_missing, fits_single_request, format_titles, summarize
+from telegram_delivery import StreamingMessage, get_sender
+from telegram_html import split_html
 
-    if key:
-        if key not in config:
-            raise KeyError(f"The key '{key}' was not found in the config file.")
-        return config[key]  # Возвращаем значение заданного ключа
-    else:
-        return config  # Возвращаем весь конфигурационный словарь
+current_directory = os.path.dirname(os.path.abspath(__file__))
 
+# Ключи, без которых скрипт не запустится
+REQUIRED_KEYS = ("project_id", "region", "TELEGRAM_BOT_TOKEN", "TEST_TELEGRAM_CHAT_ID")
+validate_config(REQUIRED_KEYS)
 
-google_credentials_file = os.path.join(os.getcwd(), 'secret.json')
-credentials = service_account.Credentials.from_service_account_file(
-    google_credentials_file, scopes=['https://www.googleapis.com/auth/cloud-platform']
-)
-vertexai.init(project=load_config('project_id'), location=load_config('region'), credentials=credentials)
-model = GenerativeModel("gemini-pro")
-chat = model.start_chat()
+# Провайдеры из llm_providers, по умолчанию Gemini; Vertex AI инициализируется один раз при импорте
+with profiled("LLM clients"):
+    router = get_router(('gemini',))
+    router.warm()
 
-def fetch_news_titles(url):
-    response = requests.get(url)
-    root = ET.fromstring(response.content)
+def fetch_news_titles(urls):
     today = datetime.datetime.now().date()
     yesterday = today - datetime.timedelta(days=1)
-    titles_today = []
+    state = FeedState(os.path.join(current_directory, "feed_state.json"))
+    items, errors = fetch_feeds(urls, start=yesterday, end=yesterday, state=state)
+    for url, error in errors.items():
+        send_error(f"Не удалось загрузить ленту {url}: {error}")
+    # Пары (заголовок, ссылка); в промпт их собирает summarization.format_titles
+    return [(item['headline'], item['link']) for item in items]
 
-    for item in root.findall('.//item'):
-        pub_date = item.find('pubDate').text
-        pub_date = datetime.datetime.strptime(pub_date, '%a, %d %b %Y %H:%M:%S %z').date()
-        if pub_date == yesterday:
-            title = item.find('title').text
-            link = item.find('link').text
-            titles_today.append((title, link))
 
-    titles_text = ' ;'.join([f"Заголовок: {title}, Ссылка: {link}" for title, link in titles_today])
-    return titles_text
+def complete_stream(prompt: str):
+    return router.stream(prompt)
 
 
-def process_titles_with_gpt(titles_text):
-    prompt_text = (
-            "Создайте сводку дня, обобщив следующие заголовки новостей на русском языке. Выделите номер каждой новости жирным шрифтом с помощью тега <b>. Для заголовков новостей используйте курсив с помощью тега <i>. Все ссылки на статьи должны быть представлены в виде гиперссылок, преобразованных в кнопки, с добавлением к URL 'https://dzarlax.dev/rss/articles/article.html?link=' и использованием тега <a href>, где название источника новости будет отображаться как название кнопки. Группируйте ссылки вместе с соответствующими заголовками по тематическому принципу. Разделите разные новости тегом переноса строки <br>. Обработайте все предоставленные новости без сокращений. Вот список заголовков и соответствующих ссылок:" + titles_text
-    )
-    print(prompt_text)
-
-    def get_chat_response(chat: ChatSession, prompt: str) -> str:
-        response = chat.send_message(prompt)
-        return response.text
-    summary = get_chat_response(chat,prompt_text)
-    return summary
+def stream_titles_to_telegram(titles):
+    # Первое сообщение уходит с первыми токенами, дальше оно дополняется через editMessageText
+    message = StreamingMessage(get_sender(load_config("TELEGRAM_BOT_TOKEN")), load_config("TEST_TELEGRAM_CHAT_ID"),
+                               disable_web_page_preview="true")
+    try:
+        for delta in complete_stream(SUMMARY_PROMPT + format_titles(titles)):
+            message.feed(delta)
+        summary = add_missing(message.raw, titles)
+        response = message.finish(summary)
+    except Exception:
+        # Недописанная сводка не должна остаться в чате рядом с повторной отправкой
+        message.discard()
+        raise
+    if not response.get('ok'):
+        message.discard()
+    return summary, response
+
+
+def process_titles_with_gpt(titles):
+    # Большой день делится на части по токенам, части обобщаются параллельно и сливаются
+    try:
+        return summarize(titles, router.complete)
+    except BudgetExceeded as e:
+        # Упрощённый режим: список заголовков со ссылками без обращения к LLM
+        send_error(f"{e}, сводка собрана без LLM")
+        return add_missing("", titles)
 
 def send_error(message):
     TELEGRAM_TOKEN = load_config("TELEGRAM_BOT_TOKEN")
     TELEGRAM_CHAT_ID = load_config("TEST_TELEGRAM_CHAT_ID")
-    send_message_url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
-    data = {
-        "chat_id": TELEGRAM_CHAT_ID,
-        "text": message
-    }
-    response = requests.post(send_message_url, data=data)
-
-def send_telegram_message(message):
+    get_sender(TELEGRAM_TOKEN).send(TELEGRAM_CHAT_ID, str(message), parse_mode=None)
+
+def send_telegram_message(messages):
     # Place your Telegram bot's API token here
     TELEGRAM_TOKEN = load_config("TELEGRAM_BOT_TOKEN")
     # Place your own Telegram user ID here
     #TELEGRAM_CHAT_ID = load_config("TELEGRAM_CHAT_ID")
     TELEGRAM_CHAT_ID = load_config("TEST_TELEGRAM_CHAT_ID")
-    send_message_url = f"https://api.telegram.org/bot{TELEGRAM_TOKEN}/sendMessage"
-    data = {
-        "parse_mode": "HTML",
-        "disable_web_page_preview": "true",
-        "chat_id": TELEGRAM_CHAT_ID,
-        "text": message,
-        "Content-Type": "application/json"
-    }
-    try:
-        response = requests.post(send_message_url, data=data)
-        response.raise_for_status()  # Вызывает исключение для неудачных HTTP-запросов
-        if response.status_code == 200:
-            send_error("Сообщение успешно отправлено")
-        else:
-            send_error(f"Ошибка при отправке сообщения: {response.status_code}")
-    except requests.RequestException as e:
-        send_error(f"Произошла ошибка при отправке сообщения: {e}")
-    send_error(response.json())
-    return response.json()
-
-def clean_html(html):
-    # Разбираем HTML
-    soup = BeautifulSoup(html, 'html.parser')
-
-    # Разрешенные теги
-    allowed_tags = ['b', 'i', 'a', 'code']
-
-    # Удаляем все теги, кроме разрешенных
-    for tag in soup.find_all():
-        if tag.name not in allowed_tags:
-            tag.unwrap()
-
-    # Возвращаем "очищенный" HTML
-    return str(soup)
-
-
-def job():
-    url = load_config("feed_url")
-    today_titles = fetch_news_titles(url)
-    summary = process_titles_with_gpt(today_titles)
-    print(summary)
-    cleaned_html = clean_html(summary)
-    send_telegram_message(cleaned_html)
-job()
\ No newline at end of file
+    # Лимиты Telegram, 429 и повторы временных сбоев обрабатывает отправитель; части уходят по порядку
+    responses = get_sender(TELEGRAM_TOKEN).send_many([(TELEGRAM_CHAT_ID, message) for message in messages],
+                                                     disable_web_page_preview="true")
+    response = next((r for r in responses if not r.get('ok')), responses[-1] if responses else
+                    {'ok': False, 'description': 'empty text'})
+    if response.get('ok'):
+        send_error("Сообщение успешно отправлено")
+    else:
+        send_error(f"Ошибка при отправке сообщения: {response.get('error_code')} {response.get('description')}")
+    send_error(response)
+    return response
+
+def job(run=None):
+    """Собирает и отправляет сводку; run - слот расписания, у каждого слота свои контрольные точки."""
+    config = load_config()
+    # Список лент в feed_urls, для старых конфигов - одна лента в feed_url
+    urls = parse_feed_urls(config.get("feed_urls") or config["feed_url"])
+    # Перезапуск в тот же день продолжает с первого незавершённого этапа
+    checkpoints = Checkpoints(os.path.join(current_directory, "checkpoints"), "mainGemini", run=run)
+    if checkpoints.done('delivered'):
+        send_error("Сводка за сегодня уже отправлена; для повторной отправки запустите с --fresh")
+        return
+    today_titles = checkpoints.stage('items', lambda: fetch_news_titles(urls))
+    if config_flag("stream_summary") and not checkpoints.done('summary') and fits_single_request(today_titles):
+        summary, response = stream_titles_to_telegram(today_titles)
+        checkpoints.put('summary', summary)
+    else:
+        summary = checkpoints.stage('summary', lambda: process_titles_with_gpt(today_titles))
+        print(summary)
+        messages = checkpoints.stage('messages', lambda: split_html(summary))
+        response = send_telegram_message(messages)
+    if response.get('ok'):
+        checkpoints.put('delivered', response)
+    usage.write_jsonl(os.path.join(current_directory, "llm_usage.jsonl"), "mainGemini")
+    send_error(usage.summary_text() + "\n" + router.summary_text())
+    if not response.get('ok'):
+        # Ошибка видна вызывающему: cron получает ненулевой код, scheduler.py - статус error
+        raise RuntimeError(f"Сводка не доставлена: {response.get('description')}")
+
+
+# При импорте из scheduler.py job() запускается по расписанию
+if __name__ == "__main__":
+    job()
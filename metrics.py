@@ -0,0 +1,145 @@
+# coding: utf-8
+import contextlib
+import datetime
+import json
+import time
+from typing import Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+from files import atomic_write
+
+
+def peak_rss_mb() -> Optional[float]:
+    """Пиковое потребление памяти процессом в МБ (ru_maxrss в Linux - в килобайтах)."""
+    if resource is None:
+        return None
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class StageRecord:
+    def __init__(self, name: str, items_in: Optional[int] = None):
+        self.name = name
+        self.items_in = items_in
+        self.items_out = None
+        self.seconds = None
+        # На сколько этап поднял пик памяти процесса; 0 - этап уложился в память предыдущих
+        self.peak_rss_growth_mb = None
+        self.status = 'ok'
+        self.error = None
+
+    def as_dict(self) -> dict:
+        return {
+            'stage': self.name,
+            'seconds': self.seconds,
+            'items_in': self.items_in,
+            'items_out': self.items_out,
+            'peak_rss_growth_mb': self.peak_rss_growth_mb,
+            'status': self.status,
+            'error': self.error,
+        }
+
+
+class RunMetrics:
+    """Время, число элементов на входе и выходе и прирост пиковой памяти по этапам одного запуска.
+
+    ru_maxrss - пик за всю жизнь процесса, поэтому для этапа считается его
+    прирост: он показывает, какой этап задаёт пик, без накладных расходов
+    tracemalloc на каждое выделение памяти.
+    """
+
+    def __init__(self, pipeline: str, infra: str):
+        self.pipeline = pipeline
+        self.infra = infra
+        self.started_at = datetime.datetime.now()
+        self._started = time.perf_counter()
+        self.stages = []
+        self.extra = {}
+        # Ошибка запуска вне этапов, например недоставленный дайджест
+        self.error = None
+
+    def fail(self, error: Exception):
+        self.error = repr(error)
+
+    @contextlib.contextmanager
+    def stage(self, name: str, items_in: Optional[int] = None):
+        """Замеряет этап; число элементов на выходе задаётся через record.items_out."""
+        record = StageRecord(name, items_in)
+        self.stages.append(record)
+        peak_before = peak_rss_mb()
+        started = time.perf_counter()
+        try:
+            yield record
+        except Exception as e:
+            record.status = 'error'
+            record.error = repr(e)
+            raise
+        finally:
+            record.seconds = time.perf_counter() - started
+            if peak_before is not None:
+                record.peak_rss_growth_mb = round(peak_rss_mb() - peak_before, 1)
+
+    def report(self) -> dict:
+        return {
+            'time': self.started_at.isoformat(timespec='seconds'),
+            'pipeline': self.pipeline,
+            'infra': self.infra,
+            'seconds': time.perf_counter() - self._started,
+            'peak_rss_mb': peak_rss_mb(),
+            'status': 'error' if self.error or any(record.status == 'error' for record in self.stages) else 'ok',
+            'error': self.error,
+            'stages': [record.as_dict() for record in self.stages],
+            **self.extra,
+        }
+
+    def write_jsonl(self, path: str):
+        """Дописывает отчёт одной JSON-строкой."""
+        with open(path, 'a') as file:
+            file.write(json.dumps(self.report(), ensure_ascii=False, default=str) + "\n")
+
+    def write_prometheus(self, path: str):
+        """Пишет отчёт в textfile-формате для node_exporter (атомарно, через временный файл)."""
+        report = self.report()
+        labels = f'pipeline="{self.pipeline}",infra="{self.infra}"'
+        lines = [
+            "# TYPE evening_news_run_seconds gauge",
+            f"evening_news_run_seconds{{{labels}}} {report['seconds']:.3f}",
+            "# TYPE evening_news_run_success gauge",
+            f"evening_news_run_success{{{labels}}} {int(report['status'] == 'ok')}",
+            "# TYPE evening_news_run_timestamp_seconds gauge",
+            f"evening_news_run_timestamp_seconds{{{labels}}} {self.started_at.timestamp():.0f}",
+        ]
+        # Строки одной метрики в textfile-формате должны идти подряд
+        for metric, attribute in (('stage_seconds', 'seconds'), ('stage_items_in', 'items_in'),
+                                  ('stage_items_out', 'items_out'),
+                                  ('stage_peak_rss_growth_megabytes', 'peak_rss_growth_mb')):
+            lines.append(f"# TYPE evening_news_{metric} gauge")
+            for record in self.stages:
+                value = getattr(record, attribute)
+                if value is not None:
+                    lines.append(f'evening_news_{metric}{{{labels},stage="{record.name}"}} {value:g}')
+        if report['peak_rss_mb'] is not None:
+            lines += ["# TYPE evening_news_peak_rss_megabytes gauge",
+                      f"evening_news_peak_rss_megabytes{{{labels}}} {report['peak_rss_mb']:.1f}"]
+        with atomic_write(path) as file:
+            file.write("\n".join(lines) + "\n")
+
+    def summary(self) -> str:
+        """Короткая сводка для служебного чата."""
+        report = self.report()
+        lines = [f"{self.pipeline} ({self.infra}): {report['seconds']:.1f} с, "
+                 f"{'успешно' if report['status'] == 'ok' else 'с ошибкой'}"]
+        for record in self.stages:
+            counts = ""
+            if record.items_in is not None or record.items_out is not None:
+                counts = f", {'?' if record.items_in is None else record.items_in}" \
+                         f" → {'?' if record.items_out is None else record.items_out}"
+            memory = f", +{record.peak_rss_growth_mb:.0f} МБ" if record.peak_rss_growth_mb else ""
+            mark = "" if record.status == 'ok' else " (ошибка)"
+            lines.append(f"{record.name}: {record.seconds:.2f} с{counts}{memory}{mark}")
+        if report['peak_rss_mb'] is not None:
+            lines.append(f"Пик памяти: {report['peak_rss_mb']:.0f} МБ")
+        return "\n".join(lines)
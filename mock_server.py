@@ -0,0 +1,276 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Локальная заглушка OpenAI, Telegram Bot API и Telegra.ph для нагрузочных прогонов без сети.
+
+Отвечает на:
+- POST .../chat/completions - категории в JSON-режиме, одну категорию или краткую сводку;
+- POST /bot<token>/sendMessage и /bot<token>/editMessageText;
+- POST /createPage;
+- GET /feed.xml?n=300&duplicate_rate=0.3 - синтетическая RSS-лента за сегодня;
+- GET /stats - счётчики запросов по методам и кодам ответа.
+
+Задержку, долю ответов 429 и долю ошибок 500 задают флаги. Скрипты направляются
+на заглушку через конфигурацию, например:
+
+    python mock_server.py --port 8080 --latency 0.3 --rate-429 0.05
+    python non-gpt.py test openai_base_url=http://127.0.0.1:8080/v1 \\
+        telegram_api_url=http://127.0.0.1:8080 telegraph_api_url=http://127.0.0.1:8080 \\
+        feed_urls=http://127.0.0.1:8080/feed.xml
+"""
+import argparse
+import collections
+import datetime
+import html
+import json
+import os
+import random
+import re
+import sys
+import threading
+import time
+import zlib
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmarks"))
+
+from classification import CATEGORIES  # noqa: E402
+from rendering import TELEGRAM_MAX_LENGTH  # noqa: E402
+from synthetic_feed import synthetic_feed  # noqa: E402
+
+# Строки запроса пакетной классификации вида "3: заголовок"
+NUMBERED_LINE = re.compile(r'^\s*(\d+)\s*[:.)]\s*(.+)$')
+TAG = re.compile(r'<[^>]*>')
+
+
+def category_for(text: str) -> str:
+    # Детерминированная категория, чтобы повторные прогоны давали одинаковый результат
+    return CATEGORIES[zlib.crc32(text.encode('utf-8')) % len(CATEGORIES)]
+
+
+def completion_text(body: dict) -> str:
+    messages = body.get('messages') or []
+    user = next((message.get('content') or '' for message in reversed(messages) if message.get('role') == 'user'), '')
+    system = " ".join(message.get('content') or '' for message in messages if message.get('role') == 'system')
+    lines = [line for line in user.splitlines() if line.strip()]
+
+    if (body.get('response_format') or {}).get('type') == 'json_object':
+        numbered = [NUMBERED_LINE.match(line) for line in lines]
+        return json.dumps({match.group(1): category_for(match.group(2)) for match in numbered if match},
+                          ensure_ascii=False)
+    if any(category in system for category in CATEGORIES):
+        return category_for(user)
+    # Сводка: по пункту на каждый заголовок
+    return "\n".join(f"<b>{index}.</b> {line.strip()[:200]}" for index, line in enumerate(lines[:50], 1))
+
+
+class MockState:
+    def __init__(self, args):
+        self.args = args
+        self.random = random.Random(args.seed)
+        self.lock = threading.Lock()
+        self.counters = collections.Counter()
+        self.message_id = 0
+        self.page_id = 0
+        self.window_started = time.monotonic()
+        self.window_requests = 0
+
+    def roll(self, probability: float) -> bool:
+        with self.lock:
+            return self.random.random() < probability
+
+    def latency(self) -> float:
+        with self.lock:
+            return max(0.0, self.random.gauss(self.args.latency, self.args.jitter))
+
+    def over_rate_limit(self) -> bool:
+        # Окно в одну секунду на весь сервер, как грубая модель лимита API
+        if not self.args.max_rps:
+            return False
+        with self.lock:
+            now = time.monotonic()
+            if now - self.window_started >= 1.0:
+                self.window_started, self.window_requests = now, 0
+            self.window_requests += 1
+            return self.window_requests > self.args.max_rps
+
+    def count(self, endpoint: str, status: int):
+        with self.lock:
+            self.counters[f"{endpoint} {status}"] += 1
+
+    def next_message_id(self) -> int:
+        with self.lock:
+            self.message_id += 1
+            return self.message_id
+
+    def next_page_id(self) -> int:
+        with self.lock:
+            self.page_id += 1
+            return self.page_id
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    state = None  # MockState, задаётся в main()
+
+    def log_message(self, format, *args):
+        if self.state.args.verbose:
+            super().log_message(format, *args)
+
+    def send_json(self, endpoint: str, status: int, payload: dict, headers: dict = None):
+        self.state.count(endpoint, status)
+        data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def read_body(self) -> dict:
+        length = int(self.headers.get('Content-Length') or 0)
+        raw = self.rfile.read(length) if length else b''
+        if 'application/json' in (self.headers.get('Content-Type') or ''):
+            return json.loads(raw or b'{}')
+        return {key: values[-1] for key, values in parse_qs(raw.decode('utf-8')).items()}
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        if url.path == '/stats':
+            self.send_json('stats', 200, dict(self.state.counters))
+        elif url.path == '/feed.xml':
+            query = {key: values[-1] for key, values in parse_qs(url.query).items()}
+            feed = synthetic_feed(int(query.get('n', 300)), float(query.get('duplicate_rate', 0.3)),
+                                  day=datetime.date.today())
+            self.state.count('feed', 200)
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/rss+xml; charset=utf-8')
+            self.send_header('Content-Length', str(len(feed)))
+            self.end_headers()
+            self.wfile.write(feed)
+        else:
+            self.send_json('unknown', 404, {'error': 'not found'})
+
+    def do_POST(self):
+        path = urlparse(self.path).path
+        body = self.read_body()
+        if path.endswith('/chat/completions'):
+            endpoint = 'openai'
+        elif path == '/createPage':
+            endpoint = 'telegraph'
+        elif path.startswith('/bot'):
+            endpoint = 'telegram.' + path.rsplit('/', 1)[-1]
+        else:
+            return self.send_json('unknown', 404, {'error': 'not found'})
+
+        time.sleep(self.state.latency())
+        args = self.state.args
+        if self.state.over_rate_limit() or self.state.roll(args.rate_429):
+            return self.rate_limited(endpoint)
+        if self.state.roll(args.error_rate):
+            return self.send_json(endpoint, 500, {'error': {'message': 'mock internal error'}})
+
+        if endpoint == 'openai':
+            self.chat_completion(body)
+        elif endpoint == 'telegraph':
+            page_id = self.state.next_page_id()
+            host = self.headers.get('Host', '127.0.0.1')
+            self.send_json(endpoint, 200, {'ok': True, 'result': {
+                'path': f"page-{page_id}", 'url': f"http://{host}/page-{page_id}", 'title': body.get('title')}})
+        else:
+            self.telegram(endpoint, body)
+
+    def rate_limited(self, endpoint: str):
+        retry_after = self.state.args.retry_after
+        if endpoint == 'openai':
+            self.send_json(endpoint, 429, {'error': {'message': 'Rate limit reached', 'type': 'rate_limit_error'}},
+                           {'Retry-After': str(retry_after)})
+        elif endpoint == 'telegraph':
+            # Telegra.ph сообщает о лимите в теле ответа с кодом 200
+            self.send_json(endpoint, 200, {'ok': False, 'error': f"FLOOD_WAIT_{retry_after}"})
+        else:
+            self.send_json(endpoint, 429, {'ok': False, 'error_code': 429,
+                                           'description': f"Too Many Requests: retry after {retry_after}",
+                                           'parameters': {'retry_after': retry_after}})
+
+    def telegram(self, endpoint: str, body: dict):
+        text = body.get('text') or ''
+        # Как и Telegram, лимит применяется к видимому тексту после разбора разметки, в единицах UTF-16
+        visible = html.unescape(TAG.sub('', text)) if body.get('parse_mode') == 'HTML' else text
+        if len(visible.encode('utf-16-le')) // 2 > TELEGRAM_MAX_LENGTH:
+            return self.send_json(endpoint, 400, {'ok': False, 'error_code': 400,
+                                                  'description': 'Bad Request: message is too long'})
+        message_id = int(body['message_id']) if body.get('message_id') else self.state.next_message_id()
+        self.send_json(endpoint, 200, {'ok': True, 'result': {
+            'message_id': message_id, 'chat': {'id': body.get('chat_id')},
+            'date': int(time.time()), 'text': text}})
+
+    def chat_completion(self, body: dict):
+        text = completion_text(body)
+        model = body.get('model', 'mock')
+        prompt_tokens = sum(len((message.get('content') or '').split()) for message in body.get('messages') or [])
+        usage = {'prompt_tokens': prompt_tokens, 'completion_tokens': len(text.split()),
+                 'total_tokens': prompt_tokens + len(text.split())}
+        created = int(time.time())
+        if body.get('stream'):
+            return self.stream_completion(model, created, text)
+        self.send_json('openai', 200, {
+            'id': f"chatcmpl-mock-{created}", 'object': 'chat.completion', 'created': created, 'model': model,
+            'choices': [{'index': 0, 'finish_reason': 'stop',
+                         'message': {'role': 'assistant', 'content': text}}],
+            'usage': usage,
+        })
+
+    def stream_completion(self, model: str, created: int, text: str):
+        # Server-sent events кусками по несколько слов, как у OpenAI
+        self.state.count('openai', 200)
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        words = re.findall(r'\S+\s*', text)
+        for start in range(0, len(words), 3):
+            delta = {'content': "".join(words[start:start + 3])}
+            chunk = {'id': f"chatcmpl-mock-{created}", 'object': 'chat.completion.chunk', 'created': created,
+                     'model': model, 'choices': [{'index': 0, 'delta': delta, 'finish_reason': None}]}
+            self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+            time.sleep(self.state.args.stream_delay)
+        final = {'id': f"chatcmpl-mock-{created}", 'object': 'chat.completion.chunk', 'created': created,
+                 'model': model, 'choices': [{'index': 0, 'delta': {}, 'finish_reason': 'stop'}]}
+        self.wfile.write(f"data: {json.dumps(final)}\n\ndata: [DONE]\n\n".encode('utf-8'))
+        self.wfile.flush()
+        self.close_connection = True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument('--latency', type=float, default=0.0, help="средняя задержка ответа, с")
+    parser.add_argument('--jitter', type=float, default=0.0, help="стандартное отклонение задержки, с")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="доля ответов 429")
+    parser.add_argument('--retry-after', type=int, default=1, help="Retry-After в ответах 429, с")
+    parser.add_argument('--max-rps', type=int, default=0, help="запросов в секунду до ответа 429, 0 - без лимита")
+    parser.add_argument('--error-rate', type=float, default=0.0, help="доля ответов 500")
+    parser.add_argument('--stream-delay', type=float, default=0.02, help="пауза между кусками потокового ответа, с")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true', help="печатать каждый запрос")
+    args = parser.parse_args()
+
+    MockHandler.state = MockState(args)
+    server = ThreadingHTTPServer((args.host, args.port), MockHandler)
+    server.daemon_threads = True
+    print(f"Заглушка API слушает http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        print(json.dumps(dict(MockHandler.state.counters), ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
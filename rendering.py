@@ -0,0 +1,139 @@
+# coding: utf-8
+"""Отрисовка дайджеста за один проход: HTML для Telegram и контент страницы Telegra.ph.
+
+Сгруппированный результат deduplication обходится один раз по столбцам, без
+groupby/apply/iterrows. Домен ссылки кэшируется, потому что одни и те же
+источники повторяются в каждой строке.
+"""
+import functools
+from urllib.parse import urlparse
+
+# Лимит Telegram: 4096 символов видимого текста после разбора разметки
+TELEGRAM_MAX_LENGTH = 4096
+ARTICLE_URL = 'https://dzarlax.dev/rss/articles/article.html?link='
+UPDATE_MARK = "<i>Обновление:</i> "
+# Видимая часть UPDATE_MARK (без тегов)
+UPDATE_MARK_TEXT = "Обновление: "
+
+
+def escape_html(text):
+    """Заменяет специальные HTML символы на их экранированные эквиваленты."""
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def escape_attribute(text):
+    return escape_html(text).replace('"', '&quot;')
+
+
+@functools.lru_cache(maxsize=65536)
+def netloc(link):
+    return urlparse(link).netloc
+
+
+def telegram_length(text):
+    """Длина строки так, как её считает Telegram - в кодовых единицах UTF-16."""
+    return len(text.encode('utf-16-le')) // 2
+
+
+class RenderedDigest:
+    def __init__(self, telegram, telegraph, telegram_length, items, sections=()):
+        self.telegram = telegram
+        self.telegraph = telegraph
+        # Видимая длина сообщения Telegram без тегов и сущностей, в единицах UTF-16
+        self.telegram_length = telegram_length
+        self.items = items
+        # (заголовок категории, его видимая длина, [(строка новости, её видимая длина)])
+        self.sections = list(sections)
+
+    @property
+    def fits_telegram(self):
+        return self.telegram_length <= TELEGRAM_MAX_LENGTH
+
+    def telegram_chunks(self, limit=TELEGRAM_MAX_LENGTH):
+        """Делит сообщение на части не длиннее limit видимых символов по границам категорий и новостей.
+
+        Теги никогда не разрываются: каждая новость целиком попадает в одну часть.
+        Категория, продолжающаяся в следующей части, повторяет свой заголовок.
+        Новость длиннее limit уходит отдельной частью как есть.
+        """
+        if self.telegram_length <= limit:
+            return [self.telegram]
+        chunks = []
+        parts, length = [], 0
+        for header, header_length, rows in self.sections:
+            segment, segment_length = [], header_length
+            for row, row_length in rows:
+                added = row_length + (1 if segment else 0)
+                if segment and length + segment_length + added > limit:
+                    # Закрываем текущую часть и продолжаем категорию в следующей
+                    parts.append(header + '\n'.join(segment))
+                    chunks.append(''.join(parts))
+                    parts, length = [], 0
+                    segment, segment_length, added = [], header_length, row_length
+                elif not segment and parts and length + header_length + row_length > limit:
+                    chunks.append(''.join(parts))
+                    parts, length = [], 0
+                segment.append(row)
+                segment_length += added
+            parts.append(header + '\n'.join(segment))
+            length += segment_length
+        if parts:
+            chunks.append(''.join(parts))
+        return chunks
+
+
+def render_digest(result, max_links=None):
+    """Строит сообщение Telegram и HTML страницы Telegra.ph из одного обхода результата.
+
+    Категории идут по алфавиту, внутри категории - в исходном порядке строк,
+    как при groupby('category'). max_links ограничивает число источников у новости.
+    """
+    headlines = result['headline'].tolist()
+    categories = result['category'].tolist()
+    links = result['links'].tolist()
+    updates = result['is_update'].tolist() if 'is_update' in result.columns else [False] * len(result)
+
+    rows_by_category = {}
+    for index, category in enumerate(categories):
+        rows_by_category.setdefault(category, []).append(index)
+
+    telegram_parts = []
+    telegraph_parts = []
+    sections = []
+    visible_length = 0
+    for category in sorted(rows_by_category):
+        category_html = escape_html(category)
+        header = f"\n\n<b>{category_html}</b>\n\n"
+        header_length = 4 + telegram_length(category)
+        telegram_parts.append(header)
+        telegraph_parts.append(f"<hr><h3>{category_html}</h3>")
+        visible_length += header_length
+
+        rows, row_lengths = [], []
+        for index in rows_by_category[category]:
+            headline = escape_html(headlines[index])
+            visible_headline = headlines[index]
+            if updates[index]:
+                headline = UPDATE_MARK + headline
+                visible_headline = UPDATE_MARK_TEXT + visible_headline
+            row_links = links[index][:max_links]
+            domains = [netloc(link) for link in row_links]
+            domains_html = [escape_html(domain) for domain in domains]
+            hrefs = [escape_attribute(ARTICLE_URL + link) for link in row_links]
+
+            links_html = '\n'.join(f'<a href="{href}">{domain}</a>' for href, domain in zip(hrefs, domains_html))
+            row = f"{headline}\n{links_html}\n"
+            rows.append(row)
+            telegraph_links = ''.join(f'<a href="{href}">{domain}</a>' for href, domain in zip(hrefs, domains_html))
+            telegraph_parts.append(f"<ul><p>{headline}  {telegraph_links}</p></ul>\n")
+
+            # Заголовок, перевод строки, домены через перевод строки, перевод строки
+            row_length = (telegram_length(visible_headline) + 2 + sum(map(telegram_length, domains))
+                          + max(len(domains) - 1, 0))
+            row_lengths.append(row_length)
+            visible_length += row_length
+        telegram_parts.append('\n'.join(rows))
+        sections.append((header, header_length, list(zip(rows, row_lengths))))
+        # Строки категории соединяются переводом строки
+        visible_length += len(rows) - 1
+    return RenderedDigest(''.join(telegram_parts), ''.join(telegraph_parts), visible_length, len(result), sections)
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# coding: utf-8
+"""Долгоживущий режим: конвейеры запускаются по расписанию в одном процессе.
+
+Запуск из cron каждый раз заново платит за старт интерпретатора, тяжёлые
+импорты, инициализацию Vertex AI и новые HTTPS-соединения. Здесь модули
+конвейеров импортируются один раз при старте, а клиенты OpenAI, Telegram и
+сессия лент остаются открытыми между запусками.
+
+Расписание берётся из ключа schedule: задача -> время "ЧЧ:ММ" (местное) или
+список времён. Задачи: digest:prod, digest:test, main, mainGemini.
+
+    python scheduler.py 'schedule={"digest:prod": "07:30", "main": ["09:00", "21:00"]}'
+
+Задачи выполняются по очереди в одном рабочем потоке: общий учёт LLM и
+лимиты Telegram не делятся между одновременными запусками. Если к сроку
+задача ещё выполняется или ждёт очереди, срабатывание пропускается.
+У задачи с несколькими временами каждый слот - отдельный запуск со своими
+контрольными точками (job(run="090000")), иначе после утренней доставки
+вечерний запуск счёл бы сводку за день уже отправленной. Задача с одним
+временем делит контрольные точки с запуском из cron.
+Состояние отдаётся по GET /health на health_host:health_port.
+"""
+import startup_profile
+
+startup_profile.install_if_requested()
+
+import datetime  # noqa: E402
+import functools  # noqa: E402
+import importlib  # noqa: E402
+import json  # noqa: E402
+import signal  # noqa: E402
+import threading  # noqa: E402
+import time  # noqa: E402
+import traceback  # noqa: E402
+from concurrent.futures import ThreadPoolExecutor  # noqa: E402
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer  # noqa: E402
+from typing import Callable, Optional  # noqa: E402
+
+from config import load_config, validate_config  # noqa: E402
+from feeds import get_session  # noqa: E402
+from llm_usage import usage  # noqa: E402
+from startup_profile import profiled  # noqa: E402
+from telegram_delivery import get_sender  # noqa: E402
+
+# Как часто цикл просыпается, даже если до ближайшей задачи далеко (перевод часов, сон машины)
+TICK_SECONDS = 30
+# Модули, которые digest.py импортирует лениво внутри этапов; в демоне их загружаем заранее
+DIGEST_MODULES = ('pandas', 'classification', 'deduplication', 'story_index', 'telegraph.utils')
+
+
+def parse_times(value) -> list:
+    """Времена запуска из "ЧЧ:ММ", "ЧЧ:ММ:СС" или списка таких строк."""
+    values = [value] if isinstance(value, str) else list(value)
+    return sorted(datetime.time.fromisoformat(item.strip()) for item in values)
+
+
+def next_run(times: list, after: datetime.datetime) -> datetime.datetime:
+    """Ближайший запуск строго после after."""
+    for day in (after.date(), after.date() + datetime.timedelta(days=1)):
+        for moment in times:
+            candidate = datetime.datetime.combine(day, moment)
+            if candidate > after:
+                return candidate
+    raise ValueError("Пустое расписание")
+
+
+def load_pipeline(name: str) -> Callable:
+    """Импортирует конвейер и возвращает его job(run=None)."""
+    module_name, _, argument = name.partition(':')
+    if module_name == 'digest':
+        import digest
+        from llm_backend import get_client
+
+        validate_config(digest.REQUIRED_KEYS)
+        for module in DIGEST_MODULES:
+            try:
+                importlib.import_module(module)
+            except ImportError as e:
+                print(f"{name}: не удалось заранее импортировать {module}: {e}")
+        get_client(load_config("openai_token"), base_url=load_config("openai_base_url"))
+        return functools.partial(digest.job, argument or 'prod')
+    if module_name in ('main', 'mainGemini') and not argument:
+        # Клиенты и Vertex AI инициализируются при импорте модуля - один раз на процесс
+        return importlib.import_module(module_name).job
+    raise ValueError(f"Неизвестная задача расписания: {name}")
+
+
+class Job:
+    def __init__(self, name: str, run: Callable, times: list):
+        self.name = name
+        self.run = run
+        self.times = times
+        self.next_run = next_run(times, datetime.datetime.now())
+        self.pending = False  # В очереди или выполняется
+        self.runs = 0
+        self.skipped = 0
+        self.last_started = None
+        self.last_seconds = None
+        self.last_status = None
+        self.last_error = None
+
+    def state(self) -> dict:
+        return {
+            'next_run': self.next_run.isoformat(timespec='seconds'),
+            'running': self.pending,
+            'runs': self.runs,
+            'skipped': self.skipped,
+            'last_started': self.last_started.isoformat(timespec='seconds') if self.last_started else None,
+            'last_seconds': self.last_seconds,
+            'last_status': self.last_status,
+            'last_error': self.last_error,
+        }
+
+
+class Scheduler:
+    def __init__(self, jobs: list, tick: float = TICK_SECONDS):
+        self.jobs = jobs
+        self.tick = tick
+        self.started = datetime.datetime.now()
+        self.heartbeat = time.monotonic()
+        self._stop = threading.Event()
+        self._lock = threading.Lock()
+        # Один рабочий поток: запуски идут по очереди
+        self._executor = ThreadPoolExecutor(max_workers=1)
+
+    def _execute(self, job: Job, slot: datetime.datetime):
+        job.last_started = datetime.datetime.now()
+        print(f"{job.last_started:%Y-%m-%d %H:%M:%S} {job.name}: запуск")
+        started = time.perf_counter()
+        # Учёт LLM и бюджеты - на каждый запуск, как в отдельном процессе
+        usage.reset()
+        try:
+            # Слоты одного дня не должны принимать доставку друг друга за свою
+            job.run(run=slot.strftime('%H%M%S') if len(job.times) > 1 else None)
+            job.last_status, job.last_error = 'ok', None
+        except BaseException as e:
+            # SystemExit и KeyboardInterrupt из job() не должны останавливать демон
+            job.last_status, job.last_error = 'error', repr(e)
+            traceback.print_exc()
+        finally:
+            job.last_seconds = round(time.perf_counter() - started, 3)
+            with self._lock:
+                job.runs += 1
+                job.pending = False
+            print(f"{job.name}: {job.last_status} за {job.last_seconds} с")
+
+    def fire(self, job: Job, slot: datetime.datetime):
+        with self._lock:
+            if job.pending:
+                # Прошлый запуск ещё идёт - второй такой же не ставим
+                job.skipped += 1
+                print(f"{job.name}: пропуск, предыдущий запуск ещё не завершён")
+                return
+            job.pending = True
+        self._executor.submit(self._execute, job, slot)
+
+    def run(self):
+        for job in self.jobs:
+            print(f"{job.name}: следующий запуск {job.next_run:%Y-%m-%d %H:%M:%S}")
+        while not self._stop.is_set():
+            now = datetime.datetime.now()
+            self.heartbeat = time.monotonic()
+            for job in self.jobs:
+                if job.next_run <= now:
+                    self.fire(job, job.next_run)
+                    # Пропущенные во время сна машины срабатывания не навёрстываем
+                    job.next_run = next_run(job.times, now)
+            wait = min((job.next_run - now).total_seconds() for job in self.jobs)
+            self._stop.wait(max(0.0, min(wait, self.tick)))
+
+    def stop(self):
+        self._stop.set()
+
+    def close(self):
+        # Дожидаемся текущего запуска, ожидающие в очереди отменяются
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def health(self) -> tuple:
+        """(HTTP-статус, тело): 503, если цикл расписания перестал просыпаться."""
+        alive = time.monotonic() - self.heartbeat <= 2 * self.tick + 5
+        with self._lock:
+            jobs = {job.name: job.state() for job in self.jobs}
+        failing = [name for name, state in jobs.items() if state['last_status'] == 'error']
+        body = {
+            'status': 'stalled' if not alive else 'degraded' if failing else 'ok',
+            'started': self.started.isoformat(timespec='seconds'),
+            'uptime_seconds': round((datetime.datetime.now() - self.started).total_seconds()),
+            'jobs': jobs,
+        }
+        return (200 if alive else 503), body
+
+
+def health_server(scheduler: Scheduler, host: str, port: int) -> ThreadingHTTPServer:
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path.split('?')[0] not in ('/health', '/'):
+                self.send_error(404)
+                return
+            status, body = scheduler.health()
+            payload = json.dumps(body, ensure_ascii=False).encode('utf-8')
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer((host, port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def build_jobs(schedule: dict) -> list:
+    if not schedule:
+        raise KeyError("Пустое расписание: задайте ключ schedule")
+    jobs = []
+    for name, times in schedule.items():
+        with profiled(f"warm up {name}"):
+            run = load_pipeline(name)
+        jobs.append(Job(name, run, parse_times(times)))
+    return jobs
+
+
+def main(schedule: Optional[dict] = None):
+    validate_config(("TELEGRAM_BOT_TOKEN",))
+    jobs = build_jobs(schedule if schedule is not None else load_config("schedule"))
+    # Соединения открываются сейчас и переиспользуются всеми запусками
+    get_sender(load_config("TELEGRAM_BOT_TOKEN"))
+    get_session()
+
+    scheduler = Scheduler(jobs)
+    server = health_server(scheduler, load_config("health_host"), int(load_config("health_port")))
+    print(f"Расписание запущено, состояние: http://{load_config('health_host')}:{load_config('health_port')}/health")
+    for signal_number in (signal.SIGTERM, signal.SIGINT):
+        signal.signal(signal_number, lambda *_: scheduler.stop())
+    try:
+        scheduler.run()
+    finally:
+        server.shutdown()
+        scheduler.close()
+        get_sender(load_config("TELEGRAM_BOT_TOKEN")).close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# coding: utf-8
+"""Профилирование холодного старта: время импорта модулей и инициализации клиентов.
+
+Включается флагом --profile-startup или переменной окружения PROFILE_STARTUP=1.
+Должен импортироваться первым, до остальных модулей проекта. По завершении
+процесса печатает таблицу и дописывает JSON-строку в startup_profile.jsonl,
+чтобы регрессии было видно при сравнении запусков.
+"""
+import atexit
+import builtins
+import contextlib
+import datetime
+import json
+import os
+import sys
+import threading
+import time
+
+PROFILE_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "startup_profile.jsonl")
+# Сколько самых медленных модулей показывать в отчёте
+REPORT_TOP = 25
+
+_original_import = builtins.__import__
+_local = threading.local()
+_records = []
+_started = None
+
+
+def enabled() -> bool:
+    return '--profile-startup' in sys.argv or os.getenv('PROFILE_STARTUP') == '1'
+
+
+def _timed_import(name, globals=None, locals=None, fromlist=(), level=0):
+    # Уже загруженные модули и относительные импорты не меряем
+    if level or name in sys.modules:
+        return _original_import(name, globals, locals, fromlist, level)
+    stack = getattr(_local, 'stack', None)
+    if stack is None:
+        stack = _local.stack = []
+    stack.append(0.0)
+    started = time.perf_counter()
+    try:
+        return _original_import(name, globals, locals, fromlist, level)
+    finally:
+        elapsed = time.perf_counter() - started
+        nested = stack.pop()
+        if stack:
+            stack[-1] += elapsed
+        _records.append({'kind': 'import', 'name': name, 'depth': len(stack),
+                         'total': elapsed, 'self': elapsed - nested})
+
+
+@contextlib.contextmanager
+def profiled(name: str):
+    """Замер инициализации (создание клиентов, загрузка моделей); без профилирования ничего не делает."""
+    if _started is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        _records.append({'kind': 'init', 'name': name, 'depth': 0, 'total': elapsed, 'self': elapsed})
+
+
+def report():
+    total = time.perf_counter() - _started
+    # Импорты верхнего уровня дают полное время импорта без двойного счёта
+    top_level_imports = sum(record['total'] for record in _records
+                            if record['kind'] == 'import' and record['depth'] == 0)
+    print(f"\nПрофиль старта: {total:.3f} с всего, из них импорты {top_level_imports:.3f} с")
+    print(f"{'вид':<7} {'всего, мс':>10} {'собств., мс':>12}  модуль")
+    slowest = sorted(_records, key=lambda record: record['total'], reverse=True)[:REPORT_TOP]
+    for record in slowest:
+        print(f"{record['kind']:<7} {record['total'] * 1000:>10.1f} {record['self'] * 1000:>12.1f}  "
+              f"{'  ' * record['depth']}{record['name']}")
+
+    with open(PROFILE_FILE, 'a') as file:
+        file.write(json.dumps({
+            'time': datetime.datetime.now().isoformat(timespec='seconds'),
+            'script': os.path.basename(sys.argv[0]),
+            'total': total,
+            'imports': top_level_imports,
+            'records': [record for record in _records if record['depth'] == 0],
+        }, ensure_ascii=False) + "\n")
+
+
+def install_if_requested():
+    global _started
+    if not enabled() or _started is not None:
+        return
+    _started = time.perf_counter()
+    builtins.__import__ = _timed_import
+    atexit.register(report)
@@ -0,0 +1,133 @@
+# coding: utf-8
+import datetime
+import json
+import os
+from typing import Optional
+
+import numpy as np
+from scipy.sparse import csr_matrix, diags, load_npz, save_npz, vstack
+from sklearn.feature_extraction.text import HashingVectorizer
+from sklearn.preprocessing import normalize
+
+from deduplication import BLOCK_SIZE, SIMILARITY_THRESHOLD
+from files import atomic_write
+
+# Сколько дней помнить уже отправленные сюжеты
+STORY_INDEX_RETENTION_DAYS = 7
+N_FEATURES = 2 ** 20
+
+
+class StoryIndex:
+    """Инкрементальный индекс уже отправленных сюжетов.
+
+    Хранит счётчики слов заголовков (HashingVectorizer не требует обучения) и
+    документные частоты признаков, поэтому новый запуск векторизует только
+    новые заголовки, а веса TF-IDF пересчитываются по накопленной статистике.
+    """
+
+    def __init__(self, path: str, today: Optional[datetime.date] = None,
+                 retention_days: int = STORY_INDEX_RETENTION_DAYS, n_features: int = N_FEATURES):
+        self.path = path
+        # Сюжеты, отправленные начиная с этой даты, не считаются уже известными,
+        # чтобы повторный запуск за тот же день не пометил всё как обновления
+        self.today = today or datetime.date.today()
+        self.retention_days = retention_days
+        self.vectorizer = HashingVectorizer(n_features=n_features, alternate_sign=False, norm=None)
+        self.counts = csr_matrix((0, n_features), dtype=np.float32)
+        self.document_frequency = np.zeros(n_features, dtype=np.int32)
+        self.dates = []
+        self.headlines = []
+        self.links = []
+        self._load()
+
+    def __len__(self):
+        return len(self.dates)
+
+    def _vectors_path(self):
+        return os.path.join(self.path, 'vectors.npz')
+
+    def _meta_path(self):
+        return os.path.join(self.path, 'meta.json')
+
+    def _load(self):
+        if not os.path.exists(self._meta_path()):
+            return
+        with open(self._meta_path(), 'r') as file:
+            meta = json.load(file)
+        self.dates = [datetime.date.fromisoformat(date) for date in meta['dates']]
+        self.headlines = meta['headlines']
+        self.links = meta['links']
+        self.counts = load_npz(self._vectors_path()).tocsr()
+        if self.counts.shape[0] != len(self.dates):
+            # Сбой между записью векторов и метаданных: строки не соответствуют друг другу
+            print(f"Индекс сюжетов {self.path} повреждён и начинается заново")
+            self.counts = csr_matrix((0, self.counts.shape[1]), dtype=np.float32)
+            self.dates, self.headlines, self.links = [], [], []
+        self._update_document_frequency()
+
+    def _update_document_frequency(self):
+        self.document_frequency = np.bincount(self.counts.indices, minlength=self.counts.shape[1]).astype(np.int32)
+
+    def save(self):
+        os.makedirs(self.path, exist_ok=True)
+        # Каждый файл заменяется целиком; несовпадение после сбоя между ними ловит _load
+        with atomic_write(self._vectors_path(), 'wb') as file:
+            save_npz(file, self.counts)
+        with atomic_write(self._meta_path()) as file:
+            json.dump({
+                'dates': [date.isoformat() for date in self.dates],
+                'headlines': self.headlines,
+                'links': self.links,
+            }, file, ensure_ascii=False)
+
+    def _weigh(self, counts: csr_matrix, extra_frequency: np.ndarray) -> csr_matrix:
+        # Сглаженный idf как у TfidfVectorizer, по индексу и новым заголовкам вместе
+        n_documents = len(self) + counts.shape[0]
+        document_frequency = self.document_frequency + extra_frequency
+        idf = np.log((1 + n_documents) / (1 + document_frequency)) + 1
+        return normalize(counts @ diags(idf.astype(np.float32)), norm='l2')
+
+    def match(self, headlines: list, threshold: float = SIMILARITY_THRESHOLD, block_size: int = BLOCK_SIZE) -> list:
+        """Для каждого заголовка - номер самого похожего сюжета прошлых дней из индекса или -1."""
+        if not headlines:
+            return []
+        previous = np.array([i for i, date in enumerate(self.dates) if date < self.today], dtype=np.int64)
+        if not len(previous):
+            return [-1] * len(headlines)
+        counts = self.vectorizer.transform(headlines).astype(np.float32)
+        extra_frequency = np.bincount(counts.indices, minlength=counts.shape[1])
+        new_vectors = self._weigh(counts, extra_frequency)
+        index_vectors_transposed = self._weigh(self.counts, extra_frequency)[previous].T.tocsc()
+
+        matches = []
+        for start in range(0, len(headlines), block_size):
+            similarity = (new_vectors[start:start + block_size] @ index_vectors_transposed).tocsr()
+            best = np.asarray(similarity.argmax(axis=1)).ravel()
+            best_similarity = similarity.max(axis=1).toarray().ravel()
+            matches.extend(int(previous[i]) if value > threshold else -1 for i, value in zip(best, best_similarity))
+        return matches
+
+    def add(self, headlines: list, links: list, date: datetime.date):
+        """Добавляет отправленные сюжеты и забывает те, что старше retention_days."""
+        # Повторный запуск за тот же день не должен дублировать записи
+        known_links = set(self.links)
+        new_items = [(headline, link) for headline, link in zip(headlines, links) if link not in known_links]
+        headlines = [headline for headline, _ in new_items]
+        links = [link for _, link in new_items]
+        if headlines:
+            counts = self.vectorizer.transform(headlines).astype(np.float32)
+            self.counts = vstack([self.counts, counts]).tocsr()
+            self.dates.extend([date] * len(headlines))
+            self.headlines.extend(headlines)
+            self.links.extend(links)
+        self.prune(date)
+
+    def prune(self, today: datetime.date):
+        oldest = today - datetime.timedelta(days=self.retention_days)
+        keep = [i for i, date in enumerate(self.dates) if date >= oldest]
+        if len(keep) != len(self.dates):
+            self.counts = self.counts[keep]
+            self.dates = [self.dates[i] for i in keep]
+            self.headlines = [self.headlines[i] for i in keep]
+            self.links = [self.links[i] for i in keep]
+        self._update_document_frequency()
@@ -0,0 +1,96 @@
+# coding: utf-8
+"""Подписчики дайджеста: кому, какие категории и в каком виде.
+
+Загрузка, классификация и группировка новостей выполняются один раз за
+запуск; для каждого подписчика из общего результата выбираются его
+категории и лимиты, затем отрисовывается его шаблон. Подписчики с
+одинаковой выборкой и шаблоном получают одно и то же отрисованное сообщение
+и одну страницу Telegraph, поэтому стоимость растёт с числом различных
+новостей, а не новостей × чатов.
+
+Ключ subscribers - список словарей:
+
+    {"name": "tech", "chat_id": "-100123", "infra": "prod",
+     "categories": ["Технологии", "Наука"], "exclude_categories": [],
+     "max_items": 30, "max_per_category": 5,
+     "template": "compact", "max_telegram_messages": 3}
+
+Шаблоны: full - все источники новости, compact - только первый,
+telegraph - всегда ссылка на страницу Telegra.ph. Если для окружения нет ни
+одного подписчика, дайджест, как и раньше, уходит в TELEGRAM_CHAT_ID (prod)
+или TEST_TELEGRAM_CHAT_ID (test).
+"""
+import collections
+from typing import Optional
+
+from config import load_config
+
+TEMPLATES = ('full', 'compact', 'telegraph')
+LEGACY_CHAT_KEYS = {'prod': "TELEGRAM_CHAT_ID", 'test': "TEST_TELEGRAM_CHAT_ID"}
+
+
+class Subscriber:
+    def __init__(self, name: str, chat_id, infra: str = 'prod', categories: Optional[list] = None,
+                 exclude_categories: Optional[list] = None, max_items: Optional[int] = None,
+                 max_per_category: Optional[int] = None, template: str = 'full',
+                 max_telegram_messages: Optional[int] = None):
+        if template not in TEMPLATES:
+            raise ValueError(f"Подписчик {name}: неизвестный шаблон {template}, допустимы {', '.join(TEMPLATES)}")
+        self.name = name
+        # Один чат или несколько, как в TELEGRAM_CHAT_ID
+        self.chat_id = chat_id
+        self.infra = infra
+        self.categories = None if categories is None else set(categories)
+        self.exclude_categories = set(exclude_categories or ())
+        self.max_items = None if max_items is None else int(max_items)
+        self.max_per_category = None if max_per_category is None else int(max_per_category)
+        self.template = template
+        self.max_telegram_messages = int(max_telegram_messages if max_telegram_messages is not None
+                                         else load_config("max_telegram_messages"))
+
+    @classmethod
+    def from_config(cls, value: dict) -> 'Subscriber':
+        return cls(**value)
+
+    @property
+    def max_links(self) -> Optional[int]:
+        """Сколько источников показывать у новости: None - все."""
+        return 1 if self.template == 'compact' else None
+
+    def select(self, categories: list, sizes: list) -> tuple:
+        """Позиции строк общего результата, которые получит подписчик, в исходном порядке.
+
+        categories и sizes - категория и число источников каждой строки. Лимиты
+        оставляют самые крупные сюжеты: чем больше источников, тем важнее новость.
+        """
+        positions = [position for position, category in enumerate(categories)
+                     if (self.categories is None or category in self.categories)
+                     and category not in self.exclude_categories]
+        if self.max_items is None and self.max_per_category is None:
+            return tuple(positions)
+        kept, per_category = [], collections.Counter()
+        for position in sorted(positions, key=lambda position: -sizes[position]):
+            if self.max_items is not None and len(kept) >= self.max_items:
+                break
+            category = categories[position]
+            if self.max_per_category is not None and per_category[category] >= self.max_per_category:
+                continue
+            per_category[category] += 1
+            kept.append(position)
+        return tuple(sorted(kept))
+
+
+def load_subscribers(infra: str) -> list:
+    """Подписчики окружения infra из ключа subscribers, иначе единственный чат окружения."""
+    subscribers = [Subscriber.from_config(value) for value in load_config("subscribers")]
+    names = [subscriber.name for subscriber in subscribers]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        # По имени отмечаются уже получившие дайджест при повторе
+        raise ValueError(f"Повторяющиеся имена подписчиков: {', '.join(duplicates)}")
+    subscribers = [subscriber for subscriber in subscribers if subscriber.infra == infra]
+    if subscribers:
+        return subscribers
+    if infra not in LEGACY_CHAT_KEYS:
+        raise ValueError(f"Неизвестное окружение: {infra}")
+    return [Subscriber(infra, load_config(LEGACY_CHAT_KEYS[infra]), infra=infra)]
@@ -0,0 +1,137 @@
+# coding: utf-8
+"""Сводка дня по заголовкам в стиле map-reduce с бюджетом токенов.
+
+Заголовки делятся на части по подсчитанным токенам, части обобщаются
+параллельно, затем частичные сводки сливаются группами, вход каждой из
+которых не превышает бюджет слияния. Ни один запрос не растёт вместе с
+числом заголовков, поэтому время ответа ограничено. Новости, которые модель
+потеряла по дороге, дописываются в конец, чтобы сводка покрывала все заголовки.
+
+Модель задаётся функцией complete(prompt, stage) -> str, где stage - 'summary'
+или 'merge' для учёта llm_usage, поэтому модуль одинаково работает с OpenAI
+(main.py) и Gemini (mainGemini.py).
+"""
+import functools
+import html
+import re
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+from urllib.parse import urlparse
+
+from rendering import ARTICLE_URL, escape_html
+
+SUMMARY_PROMPT = (
+    "Создайте сводку дня, обобщив следующие заголовки новостей на русском языке. Выделите номер каждой новости жирным шрифтом с помощью тега <b>. Для заголовков новостей используйте курсив с помощью тега <i>. Все ссылки на статьи должны быть представлены в виде гиперссылок, преобразованных в кнопки, с добавлением к URL '" + ARTICLE_URL + "' и использованием тега <a href>, где название источника новости будет отображаться как название кнопки. Группируйте ссылки вместе с соответствующими заголовками по тематическому принципу. Разделите разные новости тегом переноса строки <br>. Обработайте все предоставленные новости без сокращений. Вот список заголовков и соответствующих ссылок: "
+)
+MERGE_PROMPT = (
+    "Объедините следующие части сводки новостей в одну сводку на русском языке. Сохраните оформление: номер новости жирным шрифтом (<b>), заголовок курсивом (<i>), ссылки тегом <a href> без изменений, новости разделены <br>. Сгруппируйте новости из разных частей по тематическому принципу и пронумеруйте их заново. Не пропускайте и не сокращайте ни одной новости и ни одной ссылки. Части сводки: "
+)
+# Бюджет токенов заголовков на один запрос и входа на одно слияние
+CHUNK_TOKENS = 3000
+MERGE_TOKENS = 6000
+MAX_PARALLEL_REQUESTS = 4
+# Оценка без tiktoken: в русском тексте около 2.5 символа на токен
+CHARS_PER_TOKEN = 2.5
+NUMBER = re.compile(r'<b>\s*\d+\s*\.?\s*</b>')
+HREF = re.compile(r'href\s*=\s*["\']?([^"\'\s>]+)')
+
+
+@functools.lru_cache(maxsize=1)
+def _encoding():
+    try:
+        import tiktoken
+    except ImportError:
+        return None
+    return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str) -> int:
+    encoding = _encoding()
+    if encoding is None:
+        return int(len(text) / CHARS_PER_TOKEN) + 1
+    return len(encoding.encode(text))
+
+
+def format_titles(items: list) -> str:
+    return ' ;'.join(f"Заголовок: {title}, Ссылка: {link}" for title, link in items)
+
+
+def chunk_items(items: list, budget: int = CHUNK_TOKENS) -> list:
+    """Делит пары (заголовок, ссылка) на идущие подряд части не больше budget токенов."""
+    chunks, chunk, used = [], [], 0
+    for item in items:
+        tokens = count_tokens(format_titles([item])) + 1
+        if chunk and used + tokens > budget:
+            chunks.append(chunk)
+            chunk, used = [], 0
+        chunk.append(item)
+        used += tokens
+    if chunk:
+        chunks.append(chunk)
+    return chunks
+
+
+def group_by_budget(parts: list, budget: int) -> list:
+    groups, group, used = [], [], 0
+    for part in parts:
+        tokens = count_tokens(part)
+        if group and used + tokens > budget:
+            groups.append(group)
+            group, used = [], 0
+        group.append(part)
+        used += tokens
+    if group:
+        groups.append(group)
+    return groups
+
+
+def missing_items(summary: str, items: list) -> list:
+    # Сравниваем с адресами ссылок целиком: подстрока .../1 нашлась бы и в .../10
+    hrefs = [html.unescape(href) for href in HREF.findall(summary)]
+    present = {href[len(ARTICLE_URL):] if href.startswith(ARTICLE_URL) else href for href in hrefs}
+    return [(title, link) for title, link in items if link not in present]
+
+
+def renumber(summary: str) -> str:
+    """Сквозная нумерация новостей после склейки частей."""
+    counter = iter(range(1, 1 << 31))
+    return NUMBER.sub(lambda match: f"<b>{next(counter)}.</b>", summary)
+
+
+def summarize(items: list, complete: Callable[[str, str], str], prompt: str = SUMMARY_PROMPT,
+              chunk_tokens: int = CHUNK_TOKENS, merge_tokens: int = MERGE_TOKENS,
+              max_workers: int = MAX_PARALLEL_REQUESTS) -> str:
+    """Сводка по парам (заголовок, ссылка); небольшой день обрабатывается одним запросом, как раньше."""
+    chunks = chunk_items(items, chunk_tokens)
+    if len(chunks) <= 1:
+        summary = complete(prompt + format_titles(items), 'summary')
+    else:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            parts = list(executor.map(lambda chunk: complete(prompt + format_titles(chunk), 'summary'), chunks))
+            # Сливаем соседние части, пока группы укладываются в бюджет; части крупнее
+            # половины бюджета больше не сливаются и просто склеиваются по порядку
+            while len(parts) > 1:
+                groups = group_by_budget(parts, merge_tokens)
+                if len(groups) == len(parts):
+                    break
+                parts = list(executor.map(
+                    lambda group: group[0] if len(group) == 1 else complete(MERGE_PROMPT + "\n\n".join(group),
+                                                                           'merge'),
+                    groups))
+        summary = renumber("<br>\n".join(parts))
+    return add_missing(summary, items)
+
+
+def fits_single_request(items: list, chunk_tokens: int = CHUNK_TOKENS) -> bool:
+    """Умещается ли день в один запрос - только такую сводку можно показывать потоком."""
+    return len(chunk_items(items, chunk_tokens)) <= 1
+
+
+def add_missing(summary: str, items: list) -> str:
+    """Дописывает новости, потерянные моделью, и перенумеровывает сводку."""
+    missing = missing_items(summary, items)
+    if not missing:
+        return summary
+    summary += "".join(f'<br>\n<b>0.</b> <i>{escape_html(title)}</i> <a href="{ARTICLE_URL}{link}">{urlparse(link).netloc}</a>'
+                       for title, link in missing)
+    return renumber(summary)
@@ -0,0 +1,294 @@
+# coding: utf-8
+"""Отправка в Telegram Bot API с учётом лимитов.
+
+Telegram допускает около 30 сообщений в секунду на бота и около одного
+сообщения в секунду в один чат; при превышении отвечает 429 с
+parameters.retry_after. TelegramSender держит общий пул соединений,
+выдерживает оба лимита, повторяет временные сбои с экспоненциальной паузой
+и рассылает в несколько чатов параллельно. Через тот же пул и с теми же
+повторами идут вызовы Telegra.ph API, который о лимите сообщает ошибкой
+FLOOD_WAIT_<секунды>.
+"""
+import random
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Optional
+
+import requests
+
+from config import load_config
+from feeds import make_session
+from rendering import TELEGRAM_MAX_LENGTH
+from telegram_html import TelegramHTML
+
+REQUEST_TIMEOUT = 30
+MAX_RETRIES = 5
+BASE_DELAY = 1.0
+# Сообщений в секунду на бота и в один чат
+GLOBAL_RATE = 30.0
+PER_CHAT_RATE = 1.0
+MAX_PARALLEL_CHATS = 8
+# Не чаще одной правки потокового сообщения за столько секунд
+STREAM_EDIT_INTERVAL = 2.0
+FLOOD_WAIT = re.compile(r'FLOOD_WAIT_(\d+)')
+
+_senders = {}
+_senders_lock = threading.Lock()
+
+
+class RateLimiter:
+    """Равномерный лимит: каждый вызов acquire() получает свой слот не раньше 1/rate после предыдущего."""
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate
+        self._next = 0.0
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next)
+            self._next = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+    def defer(self, seconds: float):
+        """Сдвигает следующий слот после ответа 429."""
+        with self._lock:
+            self._next = max(self._next, time.monotonic() + seconds)
+
+
+def retry_after(response: dict) -> Optional[float]:
+    parameters = response.get('parameters') or {}
+    if parameters.get('retry_after') is not None:
+        return float(parameters['retry_after'])
+    return None
+
+
+def flood_wait(response: dict) -> Optional[float]:
+    """Пауза из ошибки Telegra.ph FLOOD_WAIT_<секунды>."""
+    match = FLOOD_WAIT.search(str(response.get('error') or ''))
+    return float(match.group(1)) if match else None
+
+
+class TelegramSender:
+    def __init__(self, token: str, api_url: Optional[str] = None, global_rate: float = GLOBAL_RATE,
+                 per_chat_rate: float = PER_CHAT_RATE, max_workers: int = MAX_PARALLEL_CHATS,
+                 max_retries: int = MAX_RETRIES, timeout: float = REQUEST_TIMEOUT,
+                 telegraph_url: Optional[str] = None):
+        self.url = f"{api_url or load_config('telegram_api_url')}/bot{token}"
+        self.telegraph_url = telegraph_url or load_config('telegraph_api_url')
+        self.per_chat_rate = per_chat_rate
+        self.max_retries = max_retries
+        self.timeout = timeout
+        self.session = make_session(max_workers)
+        self._global = RateLimiter(global_rate)
+        self._chats = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        self._pending = []
+
+    def _chat_limiter(self, chat_id) -> RateLimiter:
+        with self._lock:
+            limiter = self._chats.get(str(chat_id))
+            if limiter is None:
+                limiter = self._chats[str(chat_id)] = RateLimiter(self.per_chat_rate)
+            return limiter
+
+    def call(self, method: str, params: dict) -> dict:
+        """Вызывает метод Bot API. Всегда возвращает ответ-словарь, при неудаче с 'ok': False."""
+        chat_limiter = self._chat_limiter(params.get('chat_id'))
+        response = {}
+        for attempt in range(self.max_retries + 1):
+            chat_limiter.acquire()
+            self._global.acquire()
+            delay = BASE_DELAY * 2 ** attempt + random.uniform(0, BASE_DELAY)
+            try:
+                status, response = self._post(f"{self.url}/{method}", params)
+                if response.get('ok'):
+                    return response
+                status = response.get('error_code') or status
+                if status == 429:
+                    delay = retry_after(response) or delay
+                    chat_limiter.defer(delay)
+                elif status < 500:
+                    # Ошибки запроса (неверная разметка, чат не найден) повтор не исправит
+                    return response
+            except requests.RequestException as e:
+                response = {'ok': False, 'description': repr(e)}
+            if attempt < self.max_retries:
+                time.sleep(delay)
+        return response
+
+    def _post(self, url: str, params: dict) -> tuple:
+        """(HTTP-код, тело ответа); тело не-JSON, например страница ошибки прокси, - {'ok': False, ...}."""
+        http_response = self.session.post(url, data=params, timeout=self.timeout)
+        try:
+            response = http_response.json()
+        except ValueError:
+            response = None
+        if not isinstance(response, dict):
+            response = {'ok': False, 'error_code': http_response.status_code,
+                        'description': http_response.text[:200], 'error': http_response.text[:200]}
+        return http_response.status_code, response
+
+    def telegraph(self, method: str, params: dict) -> dict:
+        """Вызывает метод Telegra.ph API. Всегда возвращает ответ-словарь, при неудаче с 'ok': False."""
+        response = {}
+        for attempt in range(self.max_retries + 1):
+            delay = BASE_DELAY * 2 ** attempt + random.uniform(0, BASE_DELAY)
+            try:
+                status, response = self._post(f"{self.telegraph_url}/{method}", params)
+                if response.get('ok'):
+                    return response
+                if flood_wait(response) is not None:
+                    delay = flood_wait(response)
+                elif status < 500:
+                    # Неверный токен или содержимое страницы повтор не исправит
+                    return response
+            except requests.RequestException as e:
+                response = {'ok': False, 'error': repr(e)}
+            if attempt < self.max_retries:
+                time.sleep(delay)
+        return response
+
+    def send(self, chat_id, text: str, parse_mode: Optional[str] = 'HTML', **params) -> dict:
+        params = {'chat_id': chat_id, 'text': text, **params}
+        if parse_mode:
+            params['parse_mode'] = parse_mode
+        return self.call('sendMessage', params)
+
+    def submit(self, chat_id, text: str, parse_mode: Optional[str] = 'HTML', **params) -> Future:
+        """Отправляет в фоне, не задерживая основной поток; дождаться можно через flush()."""
+        future = self._executor.submit(self.send, chat_id, text, parse_mode, **params)
+        with self._lock:
+            self._pending.append(future)
+        return future
+
+    def send_many(self, messages: list, parse_mode: Optional[str] = 'HTML', **params) -> list:
+        """Отправляет пары (chat_id, text): разные чаты параллельно, в одном чате - по порядку.
+
+        Ответы возвращаются в порядке messages.
+        """
+        by_chat = {}
+        for index, (chat_id, text) in enumerate(messages):
+            by_chat.setdefault(str(chat_id), []).append((index, chat_id, text))
+
+        def send_chat(queue):
+            return [(index, self.send(chat_id, text, parse_mode, **params)) for index, chat_id, text in queue]
+
+        responses = [None] * len(messages)
+        for future in [self._executor.submit(send_chat, queue) for queue in by_chat.values()]:
+            for index, response in future.result():
+                responses[index] = response
+        return responses
+
+    def flush(self):
+        """Дожидается сообщений, отправленных через submit()."""
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for future in pending:
+            future.result()
+
+    def close(self):
+        self.flush()
+        self._executor.shutdown(wait=True)
+        self.session.close()
+
+
+def get_sender(token: str) -> TelegramSender:
+    """Общий для процесса отправитель на каждый токен бота, чтобы лимиты считались вместе."""
+    with _senders_lock:
+        sender = _senders.get(token)
+        if sender is None:
+            sender = _senders[token] = TelegramSender(token)
+        return sender
+
+
+def chat_ids(value) -> list:
+    """Один чат или список чатов из конфигурации (число, строка через запятую или JSON-список)."""
+    if isinstance(value, (list, tuple)):
+        return list(value)
+    if isinstance(value, str):
+        return [chat for chat in value.replace(',', ' ').split() if chat]
+    return [value]
+
+
+class StreamingMessage:
+    """Показывает ответ LLM по мере генерации: первое сообщение уходит сразу, дальше - editMessageText.
+
+    Правки не чаще interval секунд. Полученный текст каждый раз разбирается
+    TelegramHTML: недописанный тег или сущность в конце ждут следующей правки,
+    открытые теги закрываются. Текст длиннее limit делится так же, как
+    split_html, и продолжается новыми сообщениями. Если доставить не удалось,
+    discard() удаляет уже показанные сообщения, чтобы повторная отправка не
+    оставила в чате два варианта сводки.
+    """
+
+    def __init__(self, sender: TelegramSender, chat_id, interval: float = STREAM_EDIT_INTERVAL,
+                 limit: int = TELEGRAM_MAX_LENGTH, **params):
+        self.sender = sender
+        self.chat_id = chat_id
+        self.interval = interval
+        self.limit = limit
+        self.params = params
+        self.raw = ''
+        self.responses = []
+        # Показанные сообщения: [id, текст]; responses - последний ответ по каждой части
+        self._messages = []
+        self._updated = 0.0
+        self.first_shown_at = None
+
+    def feed(self, delta: str):
+        self.raw += delta or ''
+        if time.monotonic() - self._updated >= self.interval:
+            self._publish(final=False)
+
+    def finish(self, text: Optional[str] = None) -> dict:
+        """Публикует окончательный текст (по умолчанию - всё полученное) и возвращает ответ последнего сообщения."""
+        if text is not None:
+            self.raw = text
+        self._publish(final=True)
+        failed = next((response for response in self.responses if not response.get('ok')), None)
+        return failed or (self.responses[-1] if self.responses else {'ok': False, 'description': 'empty text'})
+
+    def discard(self):
+        """Удаляет показанные сообщения; ошибки удаления не мешают повторной отправке."""
+        for message_id, _ in self._messages:
+            self.sender.call('deleteMessage', {'chat_id': self.chat_id, 'message_id': message_id})
+        self._messages = []
+
+    def _publish(self, final: bool):
+        document = TelegramHTML()
+        document.feed(self.raw)
+        document.close(flush=final)
+        for index, text in enumerate(document.chunks(self.limit)):
+            self._show(index, text)
+        self._updated = time.monotonic()
+
+    def _show(self, index: int, text: str):
+        if index < len(self._messages):
+            message_id, shown = self._messages[index]
+            if text == shown:
+                return
+            response = self.sender.call('editMessageText', {'chat_id': self.chat_id, 'message_id': message_id,
+                                                            'text': text, 'parse_mode': 'HTML', **self.params})
+            self.responses[index] = response
+            if response.get('ok'):
+                self._messages[index][1] = text
+            return
+        if index > len(self._messages):
+            # Предыдущая часть так и не отправилась - продолжать нечем
+            return
+        response = self.sender.send(self.chat_id, text, **self.params)
+        # Неудачная отправка части повторяется при следующей правке и заменяет её ответ
+        if index < len(self.responses):
+            self.responses[index] = response
+        else:
+            self.responses.append(response)
+        if response.get('ok'):
+            self._messages.append([response['result']['message_id'], text])
+            if self.first_shown_at is None:
+                self.first_shown_at = time.monotonic()
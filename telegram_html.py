@@ -0,0 +1,258 @@
+# coding: utf-8
+"""Однопроходная очистка HTML для parse_mode=HTML в Telegram.
+
+Заменяет BeautifulSoup в clean_html: текст ответа LLM разбирается одним
+регулярным выражением за линейное время, без построения дерева.
+
+- Остаются только теги, которые понимает Telegram, и только их допустимые
+  атрибуты; <a> без http(s)/tg/mailto-ссылки разворачивается в текст.
+- <br> и концы блоков (<p>, <div>, <li>, <h1>...) становятся переводами строк.
+- Голые &, < и > экранируются, именованные сущности, которых Telegram не
+  знает (&nbsp; и т.п.), заменяются символами.
+- Неправильная вложенность чинится: при закрытии внешнего тега внутренние
+  закрываются и открываются заново, незакрытые теги закрываются в конце.
+- По ходу считается видимая длина в единицах UTF-16 (так считает лимит
+  Telegram) и запоминаются переводы строк, чтобы делить длинный текст на
+  сообщения без повторного разбора.
+
+TelegramHTML можно кормить по частям (feed), например потоком токенов LLM:
+недописанный в конце тег или сущность ждут следующей части.
+"""
+import html
+import re
+
+from rendering import TELEGRAM_MAX_LENGTH, telegram_length
+
+# Теги Telegram и псевдонимы; span допускается только как спойлер
+ALLOWED_TAGS = {'b', 'strong', 'i', 'em', 'u', 'ins', 's', 'strike', 'del', 'a', 'code', 'pre',
+                'blockquote', 'tg-spoiler', 'span'}
+BLOCK_TAGS = {'p', 'div', 'li', 'ul', 'ol', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'tr', 'table'}
+LINK_SCHEMES = ('http://', 'https://', 'tg://', 'mailto:')
+NAMED_ENTITIES = {'lt', 'gt', 'amp', 'quot'}
+# Сколько символов ждать завершения сущности, прежде чем считать & текстом
+MAX_ENTITY_LENGTH = 32
+
+TOKEN = re.compile(
+    r'<!--.*?-->'
+    r'|<(/?)([a-zA-Z][a-zA-Z0-9-]*)((?:[^<>"\']|"[^"]*"|\'[^\']*\')*)>'
+    r'|&(#[0-9]{1,7}|#[xX][0-9a-fA-F]{1,6}|[a-zA-Z][a-zA-Z0-9]{0,31});'
+    r'|[<>&]',
+    re.S)
+ATTRIBUTE = re.compile(r'([a-zA-Z_:][-a-zA-Z0-9_:.]*)(?:\s*=\s*("[^"]*"|\'[^\']*\'|[^\s"\'>]+))?')
+# Начало тега или комментария, который ещё может дописаться в следующей части
+TAG_START = re.compile(r'<[a-zA-Z/!]')
+
+
+def escape_text(text: str) -> str:
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+
+def escape_attribute(text: str) -> str:
+    return escape_text(text).replace('"', '&quot;')
+
+
+def attributes(source: str) -> dict:
+    result = {}
+    for name, value in ATTRIBUTE.findall(source):
+        if value[:1] in ('"', "'"):
+            value = value[1:-1]
+        result[name.lower()] = html.unescape(value)
+    return result
+
+
+class TelegramHTML:
+    def __init__(self):
+        self.parts = []
+        self.visible_length = 0
+        # Открытые теги: (имя, открывающий тег)
+        self.stack = []
+        # Переводы строк вне тегов: (позиция в выводе, видимая длина, открытые теги)
+        self.breaks = []
+        self._length = 0  # Длина вывода в символах
+        self._buffer = ''
+
+    def _emit(self, markup: str):
+        self.parts.append(markup)
+        self._length += len(markup)
+
+    def _text(self, visible: str, escaped: str = None):
+        if not visible:
+            return
+        escaped = escape_text(visible) if escaped is None else escaped
+        start = self._length
+        self._emit(escaped)
+        if '\n' in visible:
+            # Позиция сразу после каждого перевода строки - допустимая граница сообщения
+            offset, counted = 0, 0
+            for line in visible.split('\n')[:-1]:
+                counted += telegram_length(line) + 1
+                offset = escaped.index('\n', offset) + 1
+                self.breaks.append((start + offset, self.visible_length + counted, tuple(self.stack)))
+        self.visible_length += telegram_length(visible)
+
+    def _entity(self, name: str):
+        lowered = name.lower()
+        if lowered in NAMED_ENTITIES:
+            self._text(html.unescape(f"&{lowered};"), f"&{lowered};")
+            return
+        if name.startswith('#'):
+            try:
+                codepoint = int(name[2:], 16) if name[1:2] in ('x', 'X') else int(name[1:])
+                character = chr(codepoint)
+            except (ValueError, OverflowError):
+                character = None
+            if character and codepoint not in (0,) and not 0xD800 <= codepoint <= 0xDFFF:
+                self._text(character, f"&{name};")
+                return
+        value = html.unescape(f"&{name};")
+        # Неизвестная сущность остаётся текстом с экранированным &
+        self._text(value if value != f"&{name};" else f"&{name};")
+
+    def _open(self, name: str, source: str):
+        names = [open_name for open_name, _ in self.stack]
+        inside_code = 'code' in names or 'pre' in names
+        if inside_code and not (name == 'code' and names and names[-1] == 'pre'):
+            return
+        tag_attributes = attributes(source)
+        if name == 'a':
+            href = tag_attributes.get('href', '').strip()
+            if 'a' in names or not href.lower().startswith(LINK_SCHEMES):
+                return
+            markup = f'<a href="{escape_attribute(href)}">'
+        elif name == 'span':
+            if tag_attributes.get('class') != 'tg-spoiler':
+                return
+            markup = '<span class="tg-spoiler">'
+        elif name == 'code' and tag_attributes.get('class', '').startswith('language-'):
+            markup = f'<code class="{escape_attribute(tag_attributes["class"])}">'
+        else:
+            markup = f'<{name}>'
+        self.stack.append((name, markup))
+        self._emit(markup)
+
+    def _close(self, name: str):
+        names = [open_name for open_name, _ in self.stack]
+        if name not in names:
+            return
+        index = len(names) - 1 - names[::-1].index(name)
+        reopen = self.stack[index + 1:]
+        for open_name, _ in reversed(self.stack[index:]):
+            self._emit(f'</{open_name}>')
+        del self.stack[index:]
+        # Теги, закрытые не по порядку, открываются заново внутри родителя
+        for open_name, markup in reopen:
+            self.stack.append((open_name, markup))
+            self._emit(markup)
+
+    def _tag(self, closing: bool, name: str, source: str):
+        name = name.lower()
+        if name == 'br':
+            self._text('\n')
+        elif name in BLOCK_TAGS:
+            if closing and self.parts and not self.parts[-1].endswith('\n'):
+                self._text('\n')
+        elif name in ALLOWED_TAGS:
+            if closing:
+                self._close(name)
+            elif source.strip() != '/':
+                self._open(name, source)
+
+    def _process(self, text: str):
+        position = 0
+        for match in TOKEN.finditer(text):
+            self._text(text[position:match.start()])
+            position = match.end()
+            token = match.group(0)
+            if match.group(2):
+                self._tag(bool(match.group(1)), match.group(2), match.group(3))
+            elif match.group(4):
+                self._entity(match.group(4))
+            elif not token.startswith('<!--'):
+                self._text(token)
+        self._text(text[position:])
+
+    def _safe_end(self, text: str) -> int:
+        """Позиция, до которой текст можно разобрать, не разрывая тег или сущность."""
+        end = len(text)
+        tag_start = text.rfind('<')
+        if tag_start != -1 and '>' not in text[tag_start:] and (TAG_START.match(text, tag_start) or tag_start == end - 1):
+            end = tag_start
+        entity_start = text.rfind('&', 0, end)
+        if (entity_start != -1 and ';' not in text[entity_start:end]
+                and end - entity_start <= MAX_ENTITY_LENGTH and re.fullmatch(r'&#?[a-zA-Z0-9]*', text[entity_start:end])):
+            end = entity_start
+        return end
+
+    def feed(self, text: str):
+        self._buffer += text
+        end = self._safe_end(self._buffer)
+        chunk, self._buffer = self._buffer[:end], self._buffer[end:]
+        self._process(chunk)
+
+    @property
+    def html(self) -> str:
+        return ''.join(self.parts)
+
+    def snapshot(self) -> str:
+        """Допустимый HTML по уже разобранной части: открытые теги закрываются."""
+        return ''.join(self.parts) + ''.join(f'</{name}>' for name, _ in reversed(self.stack))
+
+    def close(self, flush: bool = True) -> str:
+        """Закрывает открытые теги и возвращает HTML.
+
+        flush=False отбрасывает недописанный тег или сущность в конце: так
+        потоковый текст показывается до последнего завершённого тега.
+        """
+        if flush:
+            self._process(self._buffer)
+        self._buffer = ''
+        for name, _ in reversed(self.stack):
+            self._emit(f'</{name}>')
+        self.stack = []
+        return self.html
+
+    def chunks(self, limit: int = TELEGRAM_MAX_LENGTH) -> list:
+        """Делит закрытый результат на сообщения не длиннее limit видимых символов по переводам строк.
+
+        Теги, открытые на границе, закрываются в конце части и открываются заново в начале следующей.
+        Строка длиннее limit остаётся целиком в своей части.
+        """
+        output = self.html
+        if self.visible_length <= limit:
+            return [output] if output.strip() else []
+        result = []
+        start, start_visible, start_stack = 0, 0, ()
+        candidate = None
+        for position, visible, stack in self.breaks + [(len(output), self.visible_length, ())]:
+            if visible - start_visible > limit and candidate is not None:
+                result.append(self._chunk(output, start, start_stack, candidate))
+                start, start_visible, start_stack = candidate
+                candidate = None
+            if visible - start_visible <= limit or candidate is None:
+                candidate = (position, visible, stack)
+        if start < len(output):
+            result.append(self._chunk(output, start, start_stack, (len(output), self.visible_length, ())))
+        return [chunk for chunk in result if chunk.strip()]
+
+    @staticmethod
+    def _chunk(output: str, start: int, start_stack: tuple, end: tuple) -> str:
+        position, _, end_stack = end
+        return (''.join(markup for _, markup in start_stack) + output[start:position]
+                + ''.join(f'</{name}>' for name, _ in reversed(end_stack)))
+
+
+def sanitize(text: str) -> TelegramHTML:
+    document = TelegramHTML()
+    document.feed(text)
+    document.close()
+    return document
+
+
+def clean_html(text: str) -> str:
+    """Очищенный HTML, который Telegram примет в parse_mode=HTML."""
+    return sanitize(text).html
+
+
+def split_html(text: str, limit: int = TELEGRAM_MAX_LENGTH) -> list:
+    """Очищает текст и делит его на сообщения Telegram одним проходом."""
+    return sanitize(text).chunks(limit)